@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 from datasets import load_dataset
-import random
+import os
 import sys
 import json
 from pytablewriter import MarkdownTableWriter
 from io import StringIO
 from pathlib import Path
 import jinja2
-from generated_definitions import DEFINITIONS
-import copy
+# The field extraction is shared with the CodeXGlue provider of main.py
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from codexglue import CodeXGlueProvider, FieldExtractor
+from utils import stable_choice
 from yaml import load, dump
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -230,63 +232,6 @@ def pretty_json(p):
     return json.dumps(p, sort_keys=False, indent=indent, separators=[", ", ": "])
 
 
-class FieldExtractor:
-    def __init__(self, file_name):
-        self.file_name = file_name
-
-    def run(self):
-        import tokenize
-        import re
-
-        was_class = False
-        fileObj = open(self.file_name)
-
-        classes = {}
-
-        for toktype, tok, start, end, line in tokenize.generate_tokens(
-            fileObj.readline
-        ):
-            # we can also use token.tok_name[toktype] instead of 'COMMENT'
-            # from the token module
-            if was_class:
-                current_class = tok
-                was_class = False
-            if tok == "class":
-                was_class = True
-            if toktype == tokenize.COMMENT:
-                if "datasets." in line:
-                    line = line.strip().split("#", 1)
-
-                    field_info = line[0].split(":", 1)
-                    search1 = re.search("['\"](.*)['\"]", field_info[0], re.IGNORECASE)
-
-                    type = field_info[1].strip()
-                    replacements = [
-                        ("datasets.features.Sequence(", "Sequence["),
-                        ('datasets.Value("string")', "string"),
-                        ('datasets.Value("int32")', 'int32'),
-                        ('datasets.Value("bool")', 'bool'),
-                        (")", "]"),
-                        (",", ""),
-                    ]
-                    for replacement in replacements:
-                        type = type.replace(*replacement)
-
-                    try:
-                        field_name = search1.group(1)
-
-                        if current_class not in classes:
-                            classes[current_class] = {}
-                        comment = line[1]
-                        classes[current_class][field_name] = dict(
-                            type=type, comment=comment
-                        )
-                    except Exception as e:
-                        print(f"PROBLEM with {line}")
-
-        return classes
-
-
 class DataSetCardWriter:
     TOC = {
         "Dataset Description": ["Dataset Summary", "Supported Tasks", "Languages"],
@@ -309,11 +254,13 @@ class DataSetCardWriter:
         ],
     }
 
-    def __init__(self, path, config_names, output_path):
+    def __init__(self, path, config_names, output_path, seed=""):
         self.input_path = path
         self.dataset_name = str(Path(path).name)
         self.config_names = config_names
         self.output_path = output_path
+        # Seed for the choice of the excerpt split, as in main.py
+        self.seed = seed
 
     def get_markdown_string(self, markdown_writer):
         markdown = ""
@@ -381,12 +328,23 @@ class DataSetCardWriter:
 
         return str(base)
 
-    def get_configs_from_exception(self, e):
-        if "[" not in str(e):
-            raise
-        s = str(e).split("[")[-1].split("]")[0].split(",")
-        s = [e.replace("'", "").replace(" ", "") for e in s]
-        return s
+    # DatasetTester of test_dataset_common, shared by all the writers for its cache of resolved builder classes
+    dataset_tester = None
+
+    def load_builder_class(self):
+        """The builder class of the dataset, loaded from ./datasets/NAME like main.py does."""
+        if DataSetCardWriter.dataset_tester is None:
+            import test_dataset_common as common
+
+            DataSetCardWriter.dataset_tester = common.DatasetTester(None, packaged_fast_path=True)
+        return self.dataset_tester.load_builder_class(self.dataset_name, is_local=True)
+
+    def discover_config_names(self):
+        """The config names, read from the BUILDER_CONFIGS of the builder class: this costs an import, not a load."""
+        builder_cls = self.load_builder_class()
+        if len(builder_cls.BUILDER_CONFIGS) == 0:
+            return ["default"]
+        return [config.name for config in builder_cls.BUILDER_CONFIGS]
 
     def get_header(self):
         MORE_INFORMATION = "[More Information Needed]"
@@ -421,25 +379,18 @@ class DataSetCardWriter:
         return s
 
     def run(self):
-        # If configs are not given, try to guess the config names using the exception string...
+        # If configs are not given, read them from the builder class
         if self.config_names == None:
-            try:
-                _ = load_dataset(self.input_path)
-                self.config_names = ["default"]
-            except Exception as e:
-                self.config_names = self.get_configs_from_exception(e)
-                print("Guessed config list:", self.config_names)
+            self.config_names = self.discover_config_names()
+            print("Config list:", self.config_names)
 
         self.configs_info = {}
         for config_name in self.config_names:
             # Load the dataset
             self.dataset = load_dataset(self.input_path, config_name)
             dataset = self.dataset
-            # Choose a split randomly
-            h = hash(self.dataset_name + config_name)
-            print(f"seed for {self.dataset_name}.{config_name} is {h}")
-            random.seed(h)
-            rnd_split = random.choice(list(dataset.keys()))
+            # Choose a split, deterministically (hash() is salted per process), the same way as main.py
+            rnd_split = stable_choice(list(dataset.keys()), f"{self.dataset_name}/{config_name}", seed=self.seed)
             # Get the split
             dataset_split = dataset[rnd_split]
 
@@ -501,121 +452,54 @@ class DataSetCardWriter:
 
 
 class CodeXGlueDataSetCardWriter(DataSetCardWriter):
-    def __init__(self, name, config_names, output_path, code_path):
-        super().__init__(name, config_names, output_path)
-        self.code_path = code_path
-        self.fe = FieldExtractor(self.code_path)
-        field_info = self.fe.run()
-        field_info_classes = list(field_info.keys())
-        self.last_class = field_info_classes[-1]
-        self.last_class_info = field_info[self.last_class]
-
-        if len(field_info_classes) != 1:
-            print(field_info_classes)
-        if "CodeXGlueCCCodeCompletionTokenJava" not in field_info_classes and 'CodeXGlueCTCodeToTextBase' not in field_info_classes:
-            assert(len(field_info_classes) == 1)
+    """The CodeXGlue specific parts come from the CodeXGlueProvider of main.py, which this writer stands in for."""
 
+    def __init__(self, name, config_names, output_path):
+        super().__init__(name, config_names, output_path)
+        # What the provider reads from its writer
+        self.path = Path(self.input_path)
+        self.name = self.dataset_name
+        # The fields cache is the default one of FieldExtractor
+        self.cache_dir = None
+        # The fields are extracted from the script NAME.py of the dataset
+        self.provider = CodeXGlueProvider(self)
+
+    @property
+    def dataset_infos(self):
+        # The provider lists the fields of each config from their features
+        return {config_name: dict(features=config["fields"]) for config_name, config in self.configs_info.items()}
+
+    def get_main_config(self):
+        train = self.dataset["train"]
+        return dict(description=train.description, citation=train.citation, homepage=train.homepage)
 
     def get_field_description(self, config_name, field_name):
-        ret = self.last_class_info.get(field_name, {}).get("comment")
-        return ret
+        return self.provider.last_class_info.get(field_name, {}).get("comment")
 
     def get_header(self):
-        dataset_name = self.dataset_name
-        dataset_shortname = dataset_name[len("code_x_glue_"):]
-        for config_name, config in DEFINITIONS.items():
-            if config["name"] == dataset_shortname:
-                break
-
-        homepage = config["project_url"].replace("madlag", "microsoft")
-        repository = "https://github.com/microsoft/CodeXGLUE"
-        return {"Homepage":homepage,}
-
-    TOC = {
-        "Dataset Description": ["Dataset Summary", "Supported Tasks", "Languages"],
-        "Dataset Structure": ["Data Instances", "Data Fields", "Data Splits"],
-        "Dataset Creation": [
-            "Curation Rationale",
-            "Source Data",
-            "Annotations",
-            "Personal and Sensitive Information",
-        ],
-        "Considerations for Using the Data": [
-            "Social Impact of Dataset",
-            "Discussion of Biases",
-            "Other Known Limitations",
-        ],
-        "Additional Information": [
-            "Dataset Curators",
-            "Licensing Information",
-            "Citation Information",
-        ],
-    }
+        return self.provider.get_header()
 
     def get_toc(self):
-        toc = copy.deepcopy(self.TOC)
-        if len(self.config_names) == 1 or "medium" in self.config_names:
-            del toc["Dataset Description"][-1]
-        return toc
-
-    def get_data_fields_description(self):
-        output_parts = []
-        for config_name, config_info in self.configs_info.items():
-            headers = ["field name", "type", "description"]
-            values = []
-            for field_name, field_description in config_info["fields"].items():
-                field_info = self.last_class_info.get(field_name, {})
-                try:
-                    type = field_info["type"]
-                    comment = field_info["comment"]
-                except:
-                    print("MISSING FIELD INFORMATION", self.dataset_name, config_name, field_name, field_info)
-                    raise
-
-                values.append([field_name, type, comment])
-
-            writer = MarkdownTableWriter(
-                table_name=f"### {config_name}", headers=headers, value_matrix=values
-            )
-
-            output_parts.append(self.get_markdown_string(writer))
-
-        all_the_same = all([output_part == output_parts[0] for output_part in output_parts])
-        if all_the_same:
-            output = "#### " + ", ".join(list(self.configs_info.keys())) + "\n\n"
-            output += output_parts[0]
-        else:
-            output = ""
-            for index, config_name in enumerate(self.configs_info):
-                output += f"#### {config_name}\n\n"
-                output += output_parts[index]
-
-        return output
+        return self.provider.get_toc(self.TOC)
 
     def get_subpart_content(self, part, subpart):
-        if subpart == "Dataset Summary":
-            return self.dataset["train"].description
-        elif subpart == "Languages":
-            return ", ".join(self.config_names)
-        elif subpart == "Dataset Curators":
-            return ", ".join(["https://github.com/"+ k for k in ["microsoft", "madlag"]])
-        elif subpart ==  "Licensing Information":
-            return "Computational Use of Data Agreement (C-UDA) License."
-        elif subpart == "Citation Information":
-            return "```\n" + self.dataset["train"].citation + "\n```"
-        elif subpart == "Data Fields":
-            return self.get_data_fields_description()
-
-
-root_dir = Path(sys.argv[1]) / "datasets"
-for f in root_dir.iterdir():
-    if f.name.startswith("code_x_glue_"):
-        name = f.name
+        return self.provider.get_subpart_content(part, subpart)
+
+
+if __name__ == "__main__":
+    root = Path(sys.argv[1]).resolve()
+    root_dir = root / "datasets"
+    # The builder classes are loaded from ./datasets/NAME
+    os.chdir(root)
+    names = sorted(f.name for f in root_dir.iterdir() if f.name.startswith("code_x_glue_"))
+    # Extract the fields of all the scripts at once, in parallel: the writers then find them in the cache
+    FieldExtractor.run_all([root_dir / name / (name + ".py") for name in names])
+    for name in names:
         #print(name)
         #if name != "code_x_glue_tc_text_to_code":
         #    continue
         configs = None
         dataset_path = root_dir / name
-        ds = CodeXGlueDataSetCardWriter(str(dataset_path), configs, dataset_path / "README.md", dataset_path / (name + ".py"))
+        ds = CodeXGlueDataSetCardWriter(str(dataset_path), configs, dataset_path / "README.md")
         ds.run()
 
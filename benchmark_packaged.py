@@ -0,0 +1,62 @@
+"""Time the dummy datasets of the packaged builders (Csv, Json, Pandas, Text), built with the in-memory fast path and
+with the generic download_and_prepare/as_dataset path.
+
+    python benchmark_packaged.py [--rows 20 1000 100000] [--repeat 5]
+"""
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import test_main
+from test_main import create_packaged_dataset
+
+
+def best_time(tester, name, repeat):
+    configs = tester.load_all_configs(name, is_local=True)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # download_and_prepare prints its progress
+        with contextlib.redirect_stdout(io.StringIO()):
+            tester.check_load_dataset(name, configs, is_local=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[20, 1000, 100000], help="rows per dummy split")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measure, the best one is kept")
+    args = parser.parse_args()
+
+    # Keep test_dataset_common offline
+    test_main.setUpModule()
+    import test_dataset_common as common
+
+    common.logging.set_verbosity_error()
+
+    cwd = os.getcwd()
+    print(f"{'builder':8} {'rows':>8} {'generic':>10} {'fast':>10} {'speedup':>8}")
+    try:
+        for rows in args.rows:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # The dummy data loader uses paths relative to the current directory
+                os.chdir(tmp_dir)
+                for builder_name in ["Csv", "Json", "Pandas", "Text"]:
+                    create_packaged_dataset(tmp_dir, builder_name, rows=rows)
+                    name = builder_name.lower()
+                    generic = best_time(common.DatasetTester(None, packaged_fast_path=False), name, args.repeat)
+                    fast = best_time(common.DatasetTester(None, packaged_fast_path=True), name, args.repeat)
+                    print(f"{builder_name:8} {rows:>8} {generic * 1000:>8.1f}ms {fast * 1000:>8.1f}ms {generic / fast:>7.1f}x")
+                os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        test_main.tearDownModule()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+from utils import write_if_changed
+
+
+def content_hash(markdown):
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+
+def read_bundle(path):
+    """{dataset name: card} of a bundle, checking the content hash of each card."""
+    path = Path(path)
+    data = path.read_bytes()
+    if path.suffix == ".gz":
+        data = gzip.decompress(data)
+    cards = {}
+    for line_number, line in enumerate(data.decode("utf-8").splitlines(), 1):
+        if len(line.strip()) == 0:
+            continue
+        record = json.loads(line)
+        if content_hash(record["markdown"]) != record["sha256"]:
+            raise ValueError(f"{path}:{line_number}: the card of {record['name']} does not match its sha256")
+        cards[record["name"]] = record["markdown"]
+    return cards
+
+
+class BundleWriter:
+    """Collect the cards of a run into a single bundle file instead of writing them into the datasets tree: one JSON
+    line {"name", "sha256", "markdown"} per dataset, sorted by name, gzipped if the path ends with .gz.
+    The cards of an existing bundle are kept (and replaced by the new ones), so that partial runs update it. The file
+    is written in one go (atomically) on close. `callback(name, changed)` is called for each added card."""
+
+    def __init__(self, path, callback=None):
+        self.path = Path(path)
+        self.callback = callback
+        self.cards = read_bundle(self.path) if self.path.exists() else {}
+
+    def add(self, name, markdown):
+        changed = self.cards.get(name) != markdown
+        self.cards[name] = markdown
+        if self.callback is not None:
+            self.callback(name, changed)
+
+    def close(self):
+        lines = [
+            json.dumps(dict(name=name, sha256=content_hash(markdown), markdown=markdown), ensure_ascii=False) + "\n"
+            for name, markdown in sorted(self.cards.items())
+        ]
+        data = "".join(lines).encode("utf-8")
+        if self.path.suffix == ".gz":
+            # mtime=0 keeps the compressed bytes identical for identical cards
+            data = gzip.compress(data, mtime=0)
+        write_if_changed(self.path, data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        # Keep what was gathered before an error or an interruption
+        self.close()
+        return False
+
+
+def unpack_bundle(path, dest_path, log=print):
+    """Write the cards of a bundle as the README.md of their dataset in `dest_path`, in a single pass.
+    Returns the number of READMEs written and left unchanged (same content)."""
+    dest_path = Path(dest_path)
+    written = unchanged = 0
+    for name, markdown in sorted(read_bundle(path).items()):
+        if not (dest_path / name).is_dir():
+            log("NO DATASET DIRECTORY", name)
+            continue
+        if write_if_changed(dest_path / name / "README.md", markdown):
+            written += 1
+        else:
+            unchanged += 1
+    return written, unchanged
@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import importlib.metadata
+import json
+import os
+from pathlib import Path
+
+from utils import write_if_changed
+
+# Source files whose content determines the gathered contexts. The template is not one of them: it is only needed to
+# render a context, which is done on every run anyway.
+GENERATOR_FILES = ["main.py", "utils.py", "cache.py", "discovery.py", "test_dataset_common.py", "codexglue.py"]
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dataset_input_hash(path, relative_paths=None):
+    """Hash of the content of every file of a dataset directory, except its README and the lock files.
+    `relative_paths` can give the list of files when it is already known (from the discovery scan for example)."""
+    root = Path(path)
+    if relative_paths is None:
+        relative_paths = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                relative_path = (Path(dirpath) / filename).relative_to(root).as_posix()
+                if relative_path != "README.md" and not relative_path.endswith(".lock"):
+                    relative_paths.append(relative_path)
+
+    h = hashlib.sha256()
+    for relative_path in sorted(relative_paths):
+        h.update(relative_path.encode("utf-8") + b"\0")
+        h.update(hash_file(root / relative_path).encode("ascii"))
+    return h.hexdigest()
+
+
+def datasets_version():
+    """Version of the installed datasets library, which builds the dummy datasets, read without importing it."""
+    try:
+        return importlib.metadata.version("datasets")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def generator_fingerprint(**parameters):
+    """Hash of the generator source code, of the datasets library version and of the parameters that change the
+    gathered contexts."""
+    h = hashlib.sha256()
+    root = Path(__file__).parent
+    for filename in GENERATOR_FILES:
+        h.update(filename.encode("utf-8") + b"\0")
+        h.update(hash_file(root / filename).encode("ascii"))
+    h.update(json.dumps(dict(parameters, datasets_version=datasets_version()), sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ContextCache:
+    """On-disk store of the render contexts, one gzipped JSON file per dataset.
+    Each entry holds the context passed to the template, the warnings raised while gathering it, and the key
+    (inputs and generator hash) it was computed for."""
+
+    def __init__(self, cache_dir):
+        self.path = Path(cache_dir) / "contexts"
+
+    def entry_file(self, name):
+        return self.path / f"{name}.json.gz"
+
+    def save(self, name, key, context, warnings):
+        self.path.mkdir(parents=True, exist_ok=True)
+        entry = dict(key=key, context=context, warnings=warnings)
+        data = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        # mtime=0 keeps the compressed bytes identical for identical contexts
+        write_if_changed(self.entry_file(name), gzip.compress(data, mtime=0))
+
+    def load(self, name, key=None):
+        """Return the cached entry for a dataset, or None if there is none or if it was computed for another key."""
+        try:
+            with gzip.open(self.entry_file(name), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            # Truncated or corrupted entry: just compute it again
+            return None
+        if key is not None and entry["key"] != key:
+            return None
+        return entry
+
+    def names(self):
+        suffix = ".json.gz"
+        if not self.path.exists():
+            return []
+        return sorted(f.name[: -len(suffix)] for f in self.path.iterdir() if f.name.endswith(suffix))
+
+
+class RunJournal:
+    """Outcome of the last processing of each dataset: the key (inputs and generator hash, as in the ContextCache) it
+    was processed with, the error string if it failed, and how long it took. Stored as a JSON file in the cache
+    directory."""
+
+    def __init__(self, cache_dir):
+        self.path = Path(cache_dir) / "journal.json"
+        try:
+            with self.path.open() as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError:
+            # Corrupted journal: start from scratch
+            self.entries = {}
+
+    def record(self, name, key, error=None, duration=None):
+        # Without a new duration (context taken from the cache), keep the one of the run that actually processed it
+        if duration is None:
+            duration = self.entries.get(name, {}).get("duration")
+        self.entries[name] = dict(key=key, error=error, duration=duration)
+
+    def failure(self, name, key=None):
+        """Return the error of the last run of a dataset if it failed with the same key (same inputs and generator),
+        None otherwise."""
+        entry = self.entries.get(name)
+        if entry is None or entry["error"] is None:
+            return None
+        # Entries of older journals have no key: they are processed again
+        if key is not None and entry.get("key") != key:
+            return None
+        return entry["error"]
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(self.path, json.dumps(self.entries, indent=1, sort_keys=True) + "\n")
@@ -0,0 +1,230 @@
+import ast
+import copy
+import json
+import re
+from pathlib import Path
+
+from pytablewriter import MarkdownTableWriter
+
+from cache import hash_file
+from utils import write_if_changed
+
+# Family specific parts of the cards of the CodeXGlue datasets (code_x_glue_*): the CodeXGlueProvider is plugged into
+# DatasetREADMESingleWriter by main.load_provider.
+
+
+FIELD_TYPE_REPLACEMENTS = [
+    ("datasets.features.Sequence(", "Sequence["),
+    ('datasets.Value("string")', "string"),
+    ('datasets.Value("int32")', 'int32'),
+    ('datasets.Value("bool")', 'bool'),
+    (")", "]"),
+    (",", ""),
+]
+
+
+def string_spans(tree, lines):
+    """Line number -> list of (start, end) columns (in characters) covered by string literals on this line."""
+    spans = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Constant, ast.JoinedStr)):
+            continue
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (str, bytes)):
+            continue
+        for lineno in range(node.lineno, node.end_lineno + 1):
+            line = lines[lineno - 1].encode("utf-8")
+            # ast columns are utf-8 byte offsets
+            start = len(line[: node.col_offset].decode("utf-8", "replace")) if lineno == node.lineno else 0
+            end = len(line[: node.end_col_offset].decode("utf-8", "replace")) if lineno == node.end_lineno else len(line)
+            spans.setdefault(lineno, []).append((start, end))
+    return spans
+
+
+def comment_lines(tree, lines):
+    """Numbers of the lines that end with a comment: those with a "#" outside of any string literal."""
+    spans = string_spans(tree, lines)
+    ret = []
+    for lineno, line in enumerate(lines, 1):
+        position = line.find("#")
+        while position != -1:
+            if not any(start <= position < end for start, end in spans.get(lineno, [])):
+                ret.append(lineno)
+                break
+            position = line.find("#", position + 1)
+    return ret
+
+
+def extract_fields(source):
+    """{class name: {field name: {type, comment}}} from the feature definitions commented like
+    `"field": datasets.Value("string"),  # comment`. A field belongs to the last class defined before it.
+    The commented lines that are not field definitions are left out."""
+    lines = source.splitlines(keepends=True)
+    tree = ast.parse(source)
+    class_lines = sorted((node.lineno, node.name) for node in ast.walk(tree) if isinstance(node, ast.ClassDef))
+
+    classes = {}
+    class_index = 0
+    current_class = None
+    for lineno in comment_lines(tree, lines):
+        line = lines[lineno - 1]
+        if "datasets." not in line:
+            continue
+        while class_index < len(class_lines) and class_lines[class_index][0] <= lineno:
+            current_class = class_lines[class_index][1]
+            class_index += 1
+
+        line = line.strip().split("#", 1)
+
+        field_info = line[0].split(":", 1)
+        search1 = re.search("['\"](.*)['\"]", field_info[0], re.IGNORECASE)
+        if search1 is None or len(field_info) != 2 or current_class is None:
+            continue
+
+        type = field_info[1].strip()
+        for replacement in FIELD_TYPE_REPLACEMENTS:
+            type = type.replace(*replacement)
+
+        classes.setdefault(current_class, {})[search1.group(1)] = dict(type=type, comment=line[1])
+
+    return classes
+
+
+class FieldExtractor:
+    """Field types and comments of a dataset script, see extract_fields. The result is cached in `cache_dir`/fields
+    (CACHE_DIR by default), one file per extractor version and file content hash: worker processes extracting fields
+    concurrently never overwrite the entries of each other."""
+
+    CACHE_DIR = Path(__file__).parent / ".cache" / "fields"
+    # Change it when extract_fields changes, so that the scripts are parsed again
+    VERSION = 2
+
+    def __init__(self, file_name, cache_dir=None):
+        self.file_name = file_name
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def cache_file(cls, file_name, cache_dir=None):
+        fields_dir = Path(cache_dir) / "fields" if cache_dir is not None else cls.CACHE_DIR
+        return fields_dir / f"{cls.VERSION}-{hash_file(file_name)}.json"
+
+    @staticmethod
+    def load(cache_file):
+        """The cached classes, or None if they are not cached."""
+        try:
+            with cache_file.open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def save(cache_file, classes):
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(cache_file, json.dumps(classes, sort_keys=True))
+
+    def run(self):
+        cache_file = self.cache_file(self.file_name, self.cache_dir)
+        classes = self.load(cache_file)
+        if classes is None:
+            classes = extract_fields(Path(self.file_name).read_text())
+            self.save(cache_file, classes)
+        return classes
+
+    @classmethod
+    def run_all(cls, file_names, workers=None, cache_dir=None):
+        """{file name: classes} for all of `file_names`, the ones missing from the cache being parsed in parallel."""
+        from concurrent.futures import ProcessPoolExecutor
+
+        cache_files = {file_name: cls.cache_file(file_name, cache_dir) for file_name in file_names}
+        results = {file_name: cls.load(cache_file) for file_name, cache_file in cache_files.items()}
+        missing = [file_name for file_name, classes in results.items() if classes is None]
+        if len(missing) != 0:
+            sources = [Path(file_name).read_text() for file_name in missing]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for file_name, classes in zip(missing, executor.map(extract_fields, sources)):
+                    cls.save(cache_files[file_name], classes)
+                    results[file_name] = classes
+        return results
+
+
+def load_definitions(path):
+    """The DEFINITIONS dict of the generated_definitions.py of a CodeXGlue dataset directory (read, not executed), or
+    an empty dict if there is none."""
+    try:
+        tree = ast.parse((Path(path) / "generated_definitions.py").read_text())
+    except OSError:
+        return {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "DEFINITIONS" for target in node.targets):
+            return ast.literal_eval(node.value)
+    return {}
+
+
+class CodeXGlueProvider:
+    PREFIX = "code_x_glue_"
+    CURATORS = ["microsoft", "madlag"]
+    LICENSE = "Computational Use of Data Agreement (C-UDA) License."
+
+    def __init__(self, writer):
+        self.writer = writer
+        field_info = FieldExtractor(writer.path / f"{writer.name}.py", cache_dir=writer.cache_dir).run()
+        if len(field_info) == 0:
+            raise ValueError(f"No field information found in the {writer.name} script")
+        # The fields are commented in the last builder class of the script
+        self.last_class = list(field_info.keys())[-1]
+        self.last_class_info = field_info[self.last_class]
+
+    def get_toc(self, toc):
+        toc = copy.deepcopy(toc)
+        if len(self.writer.config_names) == 1 or "medium" in self.writer.config_names:
+            del toc["Dataset Description"][-1]
+        return toc
+
+    def get_header(self):
+        shortname = self.writer.name[len(self.PREFIX):]
+        homepage = self.writer.get_main_config()["homepage"]
+        for definition in load_definitions(self.writer.path).values():
+            if definition["name"] == shortname:
+                homepage = definition["project_url"].replace("madlag", "microsoft")
+                break
+        return {"Homepage": homepage}
+
+    def get_data_fields_description(self):
+        output_parts = []
+        for config_name in self.writer.configs_info:
+            headers = ["field name", "type", "description"]
+            values = []
+            for field_name in self.writer.dataset_infos[config_name]["features"]:
+                field_info = self.last_class_info.get(field_name, {})
+                if "type" not in field_info or "comment" not in field_info:
+                    raise ValueError(f"Missing field information for {config_name}/{field_name}: {field_info}")
+                values.append([field_name, field_info["type"], field_info["comment"]])
+
+            writer = MarkdownTableWriter(table_name=f"### {config_name}", headers=headers, value_matrix=values)
+            output_parts.append(self.writer.get_markdown_string(writer))
+
+        if all(output_part == output_parts[0] for output_part in output_parts):
+            output = "#### " + ", ".join(self.writer.configs_info) + "\n\n"
+            output += output_parts[0]
+        else:
+            output = ""
+            for config_name, output_part in zip(self.writer.configs_info, output_parts):
+                output += f"#### {config_name}\n\n"
+                output += output_part
+        return output
+
+    def get_subpart_content(self, part, subpart):
+        """The content of a subpart of the card, or None for the default one."""
+        main_config = self.writer.get_main_config()
+        if subpart == "Dataset Summary":
+            return main_config["description"]
+        elif subpart == "Languages":
+            return ", ".join(self.writer.config_names)
+        elif subpart == "Dataset Curators":
+            return ", ".join(["https://github.com/" + k for k in self.CURATORS])
+        elif subpart == "Licensing Information":
+            return self.LICENSE
+        elif subpart == "Citation Information":
+            return "```\n" + main_config["citation"] + "\n```"
+        elif subpart == "Data Fields":
+            return self.get_data_fields_description()
+        return None
@@ -0,0 +1,238 @@
+import ast
+import errno
+import fnmatch
+import json
+import os
+import re
+import subprocess
+from pathlib import Path
+
+from cache import GENERATOR_FILES, dataset_input_hash
+
+# Changing one of these files (relative to the generator directory) can change every card
+GENERATOR_PATHS = GENERATOR_FILES + ["README.template.md"]
+
+
+class DatasetEntry:
+    """What a single scandir pass found in a dataset directory: the presence and stat of the dataset script, of
+    dataset_infos.json, of the README and of the dummy data zips, plus the list of every file of the directory."""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = Path(path)
+        self.is_dir = False
+        # os.stat_result of each file, or None if it is missing
+        self.script = None
+        self.infos = None
+        self.readme = None
+        # Relative path -> os.stat_result for each dummy_data.zip (dummy/CONFIG/VERSION/dummy_data.zip)
+        self.dummy_zips = {}
+        # Relative path -> os.stat_result for every file of the directory
+        self.files = {}
+        self._input_hash = None
+
+    def skip_reason(self):
+        """Why this directory cannot be processed at all, or None if it looks like a dataset."""
+        if not self.is_dir:
+            return "not a dataset directory"
+        if self.script is None:
+            return f"no dataset script {self.name}.py"
+        return None
+
+    def input_files(self):
+        """The files the card is made from: all of them but the README, and the lock file the datasets library
+        creates (and touches) next to the script when it loads it."""
+        return [p for p in self.files if p != "README.md" and not p.endswith(".lock")]
+
+    def input_hash(self):
+        if self._input_hash is None:
+            self._input_hash = dataset_input_hash(self.path, self.input_files())
+        return self._input_hash
+
+    def scan(self, path=None, prefix=""):
+        path = self.path if path is None else path
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                relative_path = prefix + dir_entry.name
+                if dir_entry.is_dir():
+                    self.scan(dir_entry.path, relative_path + "/")
+                    continue
+                if not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                self.files[relative_path] = stat
+                if relative_path == self.name + ".py":
+                    self.script = stat
+                elif relative_path == "dataset_infos.json":
+                    self.infos = stat
+                elif relative_path == "README.md":
+                    self.readme = stat
+                elif relative_path.startswith("dummy/") and dir_entry.name == "dummy_data.zip":
+                    self.dummy_zips[relative_path] = stat
+
+
+def inspect_script(script_path):
+    """Statically inspect a dataset script, without importing it.
+    Returns (has_builder_configs, test_dummy_data), or None if the script cannot be parsed."""
+    try:
+        with open(script_path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=str(script_path))
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    has_builder_configs = False
+    test_dummy_data = True
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for base in node.bases:
+            base_name = base.attr if isinstance(base, ast.Attribute) else getattr(base, "id", None)
+            # Beam datasets are not tested with dummy data
+            if base_name == "BeamBasedBuilder":
+                test_dummy_data = False
+        for statement in node.body:
+            if isinstance(statement, ast.Assign):
+                targets, value = statement.targets, statement.value
+            elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+                targets, value = [statement.target], statement.value
+            else:
+                continue
+            for target in targets:
+                if not isinstance(target, ast.Name):
+                    continue
+                if target.id == "BUILDER_CONFIGS":
+                    has_builder_configs = not (isinstance(value, (ast.List, ast.Tuple)) and len(value.elts) == 0)
+                elif target.id == "test_dummy_data" and isinstance(value, ast.Constant) and value.value is False:
+                    test_dummy_data = False
+    return has_builder_configs, test_dummy_data
+
+
+def precheck(entry, datasets_root=None):
+    """Detect from the filesystem (and a static inspection of the script) the datasets that cannot succeed, or whose
+    dummy data cannot be loaded, without importing their builder.
+    Returns (error, load_dummy_data, load_warning):
+    - error: the exception the processing would fail with, or None
+    - load_dummy_data: False if loading the dummy data is known to yield nothing
+    - load_warning: the exception loading the dummy data would have raised, or None
+    `datasets_root` is the directory the dummy data is loaded from (./datasets if not given), as the error names it."""
+    if entry.infos is None:
+        path = str(entry.path / "dataset_infos.json")
+        return FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path), False, None
+
+    inspection = inspect_script(entry.path / (entry.name + ".py"))
+    if inspection is None:
+        return None, True, None
+    has_builder_configs, test_dummy_data = inspection
+    if not test_dummy_data:
+        # The dummy data loader skips these datasets
+        return None, False, None
+
+    if len(entry.dummy_zips) != 0:
+        return None, True, None
+
+    # No dummy data at all: the first config to be loaded (the first one in the card) fails, build the same error
+    try:
+        with (entry.path / "dataset_infos.json").open() as f:
+            infos = json.load(f)
+        first_config = infos[sorted(infos)[0]]
+        version = first_config["version"]["version_str"]
+    except Exception:
+        return None, True, None
+    if has_builder_configs:
+        dummy_data_folder = os.path.join("dummy", first_config["config_name"], version)
+    else:
+        dummy_data_folder = os.path.join("dummy", version)
+    dummy_zip = os.path.join(str(datasets_root or "datasets"), entry.name, dummy_data_folder, "dummy_data.zip")
+    return None, False, FileNotFoundError(f"Local file {dummy_zip} doesn't exist")
+
+
+def compile_filter(pattern):
+    """Build a name predicate from a glob pattern, or from a regular expression when prefixed with `re:`."""
+    if pattern.startswith("re:"):
+        regex = re.compile(pattern[len("re:"):])
+    else:
+        regex = re.compile(fnmatch.translate(pattern))
+    return lambda name: regex.fullmatch(name) is not None
+
+
+def discover_datasets(root, names=None, include=None, exclude=None):
+    """Scan the datasets directory `root` and return a sorted list of DatasetEntry, without importing anything.
+    If `names` is given, only those datasets are scanned. `include`/`exclude` are lists of glob (or `re:` prefixed
+    regex) patterns on the dataset names: a dataset is kept if it matches any include and no exclude pattern."""
+    root = Path(root)
+    include = [compile_filter(p) for p in include or []]
+    exclude = [compile_filter(p) for p in exclude or []]
+
+    def keep(name):
+        if include and not any(f(name) for f in include):
+            return False
+        return not any(f(name) for f in exclude)
+
+    if names is None:
+        with os.scandir(root) as it:
+            candidates = [(e.name, e.is_dir()) for e in it if not e.name.startswith(".")]
+    else:
+        candidates = [(name, (root / name).is_dir()) for name in names]
+
+    return [scan_dataset(root / name, is_dir) for name, is_dir in sorted(candidates) if keep(name)]
+
+
+def scan_dataset(path, is_dir=None):
+    """The DatasetEntry of the directory `path` (named after it)."""
+    path = Path(path)
+    entry = DatasetEntry(path.name, path)
+    entry.is_dir = path.is_dir() if is_dir is None else is_dir
+    if entry.is_dir:
+        entry.scan()
+    return entry
+
+
+class GitError(Exception):
+    """A git command failed: the message holds what git printed on stderr."""
+
+
+def run_git(directory, *args):
+    """The output of a git command run in `directory`."""
+    command = ["git", "-C", str(directory)] + list(args)
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    except OSError as e:
+        raise GitError(f"cannot run git: {e}") from e
+    if process.returncode != 0:
+        raise GitError(f"git {' '.join(args)} failed in {directory}: {process.stderr.strip()}")
+    return process.stdout
+
+
+def git_changed_paths(directory, rev):
+    """Paths (relative to `directory`) changed in the working tree of `directory` since it forked from git revision
+    `rev`: the changes made on `rev` since the fork point (a branch that moved on) are not counted."""
+    base = run_git(directory, "merge-base", rev, "HEAD").strip()
+    output = run_git(directory, "diff", "--name-only", "--relative", base, "--", ".")
+    return [line for line in output.split("\n") if line]
+
+
+def changed_dataset_names(root, paths):
+    """Names of the datasets of `root` affected by the changed `paths` (relative to `root`)."""
+    root = Path(root)
+    names = set()
+    for path in paths:
+        parts = path.split("/")
+        # Files at the root are not part of a dataset, README changes alone do not require a new card, and deleted
+        # datasets cannot get one
+        if len(parts) < 2 or parts[1:] == ["README.md"]:
+            continue
+        if (root / parts[0]).is_dir():
+            names.add(parts[0])
+    return sorted(names)
+
+
+def changed_datasets(root, rev, generator_rev=None):
+    """Names of the datasets of `root` whose files (script, infos, dummy data...) changed since git revision `rev` of
+    the datasets repository.
+    If `generator_rev` (a revision of the generator repository) is given, returns None if the generator code or the
+    template changed since then, as every card is then affected. Raises GitError if git fails."""
+    if generator_rev is not None:
+        generator_changes = git_changed_paths(Path(__file__).parent, generator_rev)
+        if any(path in GENERATOR_PATHS for path in generator_changes):
+            return None
+    return changed_dataset_names(root, git_changed_paths(root, rev))
@@ -1,16 +1,64 @@
 from pathlib import Path
-import os
+import importlib
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import namedtuple
+from contextlib import closing, contextmanager
 
-import random
 import json
 from pytablewriter import MarkdownTableWriter
 from io import StringIO
-from pathlib import Path
 import jinja2
-from utils import pretty_json
-import datasets
+from utils import peak_rss, pretty_json, stable_choice
 from collections import defaultdict
-import test_dataset_common as common
+from bundle import BundleWriter, read_bundle, unpack_bundle
+from cache import ContextCache, RunJournal, generator_fingerprint
+from discovery import GitError, changed_datasets, discover_datasets, precheck, scan_dataset
+from memprofile import DatasetMemoryProfile, memory_report
+from metrics import RunMetrics
+from pipeline import AsyncWriter, Prefetcher
+from profiling import DatasetProfiler
+from progress import ProgressReporter
+
+# NB: `datasets` and `test_dataset_common` are imported lazily, so that re-rendering cached contexts does not need them
+
+# Family specific parts of the cards, by dataset name prefix: (module, class), imported only for the matching datasets
+PROVIDERS = {
+    "code_x_glue_": ("codexglue", "CodeXGlueProvider"),
+}
+
+
+def load_provider(name):
+    """The provider class for the dataset `name`, or None if it has no family specific parts."""
+    for prefix, (module_name, class_name) in PROVIDERS.items():
+        if name.startswith(prefix):
+            return getattr(importlib.import_module(module_name), class_name)
+    return None
+
+
+def load_template():
+    template_file = Path(__file__).parent / "README.template.md"
+    return jinja2.Template(template_file.open().read())
+
+
+def render_card(template, context):
+    """Render the README template with a gathered context, removing trailing spaces and duplicate empty lines."""
+    ret = template.render(**context)
+
+#        yaml_header = self.get_yaml_header() + "\n"
+#        ret = yaml_header + ret
+
+    ret = ret.split("\n")
+    new_ret = ""
+    was_empty = True
+    for line in ret:
+        empty = len(line.strip()) == 0
+        if not empty or not was_empty:
+            new_ret += line.rstrip() + "\n"
+        was_empty = empty
+    return new_ret
+
 
 def pprint(a):
     print(json.dumps(a, indent=4))
@@ -82,22 +130,83 @@ class DatasetREADMESingleWriter:
         ],
     }
 
-    def __init__(self, path, name, max_configs=5):
+    def __init__(
+        self,
+        path,
+        name,
+        max_configs=5,
+        seed="",
+        load_dummy_data=True,
+        load_warning=None,
+        config_workers=1,
+        deduplicate_configs=True,
+        memory_profile=None,
+        dataset_infos=None,
+        datasets_root=None,
+        cache_dir=None,
+    ):
         # Dataset path in datasets repository
         self.path = Path(path)
+        # Directory the builder and the dummy data are loaded from (./datasets if not given)
+        self.datasets_root = datasets_root
+        # Cache directory of the providers (the default one if not given)
+        self.cache_dir = cache_dir
         # Dataset name
         self.name = name
         # Max number of configs to show
         self.max_configs = max_configs
+        # Seed for the choice of the excerpt split
+        self.seed = seed
+        # Set by the precheck when loading the dummy data is known to fail or to yield nothing
+        self.load_dummy_data = load_dummy_data
+        self.load_warning = load_warning
+        # Number of configs built concurrently
+        self.config_workers = config_workers
+        # Build only once the configs that share the same dummy data, features and builder kwargs
+        self.deduplicate_configs = deduplicate_configs
+        # Number of configs whose dummy data was asked for, and of dummy datasets actually built for them
+        self.configs_requested = 0
+        self.configs_built = 0
+        # Seconds spent in each stage of gather_context (not counting the time of the stages nested in it)
+        self.timings = {}
+        self.open_stages = []
+        # DatasetMemoryProfile recording the memory used by each stage, in --memprofile mode
+        self.memory_profile = memory_profile
+        # Parsed dataset_infos.json, when it was read ahead of time
+        self.prefetched_infos = dataset_infos
+        # Family specific parts of the card, if any
+        provider_cls = load_provider(name)
+        self.provider = provider_cls(self) if provider_cls is not None else None
         # Load the jinja template
-        template_file = Path(__file__).parent / "README.template.md"
-        self.template = jinja2.Template(template_file.open().read())
+        self.template = load_template()
         # Initialize the warnings
         self.warnings = []
+        # Cleared when the context depends on more than the dataset files (a download or a memory error for example),
+        # and must then not be stored in the context cache
+        self.cacheable = True
 
     def warn(self, message):
         self.warnings.append(message)
 
+    @contextmanager
+    def stage(self, name):
+        """Account the time (and memory, when profiled) of a stage of gather_context."""
+        if self.memory_profile is not None:
+            self.memory_profile.enter(name)
+        # [start time, time spent in nested stages]
+        current = [time.time(), 0.0]
+        self.open_stages.append(current)
+        try:
+            yield
+        finally:
+            self.open_stages.pop()
+            duration = time.time() - current[0]
+            self.timings[name] = self.timings.get(name, 0.0) + duration - current[1]
+            if len(self.open_stages) != 0:
+                self.open_stages[-1][1] += duration
+            if self.memory_profile is not None:
+                self.memory_profile.exit(name)
+
     def get_markdown_string(self, markdown_writer):
         # Build a markdown string from a markdown writer (for tables layout for example)
         markdown = ""
@@ -121,6 +230,8 @@ class DatasetREADMESingleWriter:
         return size
 
     def get_header(self):
+        if self.provider is not None:
+            return self.provider.get_header()
         # Build a dictionary containing information from the dataset for the header part of the jina template
         header_keys = ["Homepage", "Repository", "Paper", "Point of Contact"]
 
@@ -202,7 +313,16 @@ class DatasetREADMESingleWriter:
             # The splits are not the same -> no aggregated table
             return None
 
+    def get_toc(self):
+        if self.provider is not None:
+            return self.provider.get_toc(self.TOC)
+        return self.TOC
+
     def get_subpart_content(self, part, subpart):
+        if self.provider is not None:
+            content = self.provider.get_subpart_content(part, subpart)
+            if content is not None:
+                return content
         main_config = self.get_main_config()
         if subpart == "Dataset Summary":
             return main_config.get("description", self.MORE_INFORMATION)
@@ -218,20 +338,35 @@ class DatasetREADMESingleWriter:
             return ""
             #return self.get_data_fields_description()
 
-    def load_dummy_dataset(self, dataset_name):
+    def iter_dummy_datasets(self, config_names):
+        """Build the dummy dataset of each of `config_names` in turn, yielding (config name, DatasetDict) pairs.
+        Each dataset should be dropped before asking for the next one, so only one config is in memory at a time.
+        Equivalent configs may share the same dataset, they are then yielded one after the other."""
+        import test_dataset_common as common
 
-        dataset_tester = common.DatasetTester(None)
-        configs = dataset_tester.load_all_configs(dataset_name=dataset_name, is_local=True)
-        configs = dataset_tester.check_load_dataset(dataset_name, configs, is_local=True)
-        return configs
+        dataset_tester = common.DatasetTester(None, packaged_fast_path=True, datasets_dir=self.datasets_root)
+        configs = dataset_tester.load_all_configs(dataset_name=self.name, is_local=True)
+        configs_by_name = {("default" if config is None else config.name): config for config in configs}
+        configs = [configs_by_name[config_name] for config_name in config_names if config_name in configs_by_name]
+        try:
+            yield from dataset_tester.iter_load_dataset(
+                self.name,
+                configs,
+                is_local=True,
+                num_workers=self.config_workers,
+                deduplicate=self.deduplicate_configs,
+            )
+        finally:
+            self.configs_requested += dataset_tester.configs_requested
+            self.configs_built += dataset_tester.configs_built
 
-    def get_best_excerpt(self, config_name, split_name):
+    def get_best_excerpt(self, config_name, split_name, dataset):
         try:
             best_excerpt = ""
 
             MIN_LENGTH = 100
             MAX_LENGTH = 1000
-            for i, e in enumerate(self.dataset_per_config[config_name][split_name]):
+            for i, e in enumerate(dataset[split_name]):
                 if i > 100:
                     break
                 excerpt = pretty_json(e)
@@ -255,63 +390,84 @@ class DatasetREADMESingleWriter:
             for key in self.SIZE_KEYS.keys():
                 self.global_sizes[key] += config[key]
 
-    def run(self):
-        try:
-            self.dataset_per_config = self.load_dummy_dataset(self.name)
-        except Exception as e:
-            self.warn(e)
-
-#        with open(path / (name + ".py")) as f:
-#            print(f.read())
-#        for filename in os.listdir(self.path):
-#            print(filename)
-
-        with open(self.path / "dataset_infos.json") as f:
-            self.dataset_infos = json.load(f)
+    def gather_context(self):
+        """Build the dictionary of everything the template needs: this is the expensive part of a card."""
+        with self.stage("infos"):
+            if self.prefetched_infos is not None:
+                self.dataset_infos = self.prefetched_infos
+            else:
+                with open(self.path / "dataset_infos.json") as f:
+                    self.dataset_infos = json.load(f)
             dataset_infos = self.dataset_infos
             #print(json.dumps(dataset_infos, indent=4))
 
-        self.compute_sizes()
-
-        self.config_names = list(dataset_infos.keys())
-        self.config_names.sort()
-
-        self.configs_info = {}
-        for config_num, config_name in enumerate(self.config_names[:self.max_configs]):
-            input_config = dataset_infos[config_name]
-            config = {}
-            self.configs_info[config_name] = config
-
-            splits = list(input_config["splits"].keys())
-            config["data_splits_str"], config["split_sizes"] = self.config_split_sizes_string(input_config, config_name)
-
-            if "test" in splits and len(splits) != 1:
-                splits.remove("test")
-
-            config["excerpt_split"] = random.choice(splits)
-            config["excerpt"] = self.get_best_excerpt(config_name, config["excerpt_split"])
-            config["fields"] = "\n".join(show_features(input_config["features"]))
-
-            config["sizes"] = {}
-            for size_name, human_size_name in self.SIZE_KEYS.items():
-                if size_name in input_config:
-                    config["sizes"][size_name] = (human_size_name, self.format_size(input_config[size_name]))
-
-        # Prettyfying the config split size: check if all configs have the same splits, and if yes, build a single
-        # table containing all the split sizes
-        aggregated_data_splits_str = self.aggregated_config_splits()
-
-        header = self.get_header()
-
-        toc = self.TOC
-
-        for part_name, subparts in toc.items():
-            toc[part_name] = {}
-            for subpart in subparts:
-                toc[part_name][subpart] = self.get_subpart_content(part_name, subpart)
-
-        # Render the template with the gathered information
-        ret = self.template.render(
+            self.compute_sizes()
+
+            self.config_names = list(dataset_infos.keys())
+            self.config_names.sort()
+
+            self.configs_info = {}
+            for config_num, config_name in enumerate(self.config_names[:self.max_configs]):
+                input_config = dataset_infos[config_name]
+                config = {}
+                self.configs_info[config_name] = config
+
+                splits = list(input_config["splits"].keys())
+                config["data_splits_str"], config["split_sizes"] = self.config_split_sizes_string(input_config, config_name)
+
+                if "test" in splits and len(splits) != 1:
+                    splits.remove("test")
+
+                # Deterministic choice, so repeated (or parallel) runs produce the same card
+                config["excerpt_split"] = stable_choice(splits, f"{self.name}/{config_name}", seed=self.seed)
+                # Filled below, once the dummy data of this config is built
+                config["excerpt"] = None
+                config["fields"] = "\n".join(show_features(input_config["features"]))
+
+                config["sizes"] = {}
+                for size_name, human_size_name in self.SIZE_KEYS.items():
+                    if size_name in input_config:
+                        config["sizes"][size_name] = (human_size_name, self.format_size(input_config[size_name]))
+
+        # Stream the dummy datasets of the configs shown in the card: build one, extract its excerpt, drop it
+        with self.stage("dummy_data"):
+            if self.load_warning is not None:
+                self.warn(self.load_warning)
+            if self.load_dummy_data:
+                try:
+                    for config_name, dataset in self.iter_dummy_datasets(list(self.configs_info)):
+                        if dataset is None:
+                            # Dataset not tested with dummy data
+                            break
+                        with self.stage("excerpt"):
+                            config = self.configs_info[config_name]
+                            config["excerpt"] = self.get_best_excerpt(config_name, config["excerpt_split"], dataset)
+                            del dataset
+                except Exception as e:
+                    self.warn(e)
+                    if is_transient_error(e):
+                        self.cacheable = False
+
+            for config_name, config in self.configs_info.items():
+                if config["excerpt"] is None:
+                    # No dummy dataset for this config: this only records the warning
+                    config["excerpt"] = self.get_best_excerpt(config_name, config["excerpt_split"], None)
+
+        with self.stage("sections"):
+            # Prettyfying the config split size: check if all configs have the same splits, and if yes, build a single
+            # table containing all the split sizes
+            aggregated_data_splits_str = self.aggregated_config_splits()
+
+            header = self.get_header()
+
+            toc = {}
+            for part_name, subparts in self.get_toc().items():
+                toc[part_name] = {}
+                for subpart in subparts:
+                    toc[part_name][subpart] = self.get_subpart_content(part_name, subpart)
+
+        # The context must stay JSON serializable, as it is stored in the context cache
+        return dict(
             dataset_name = self.name,
             toc=toc,
             header=header,
@@ -320,27 +476,395 @@ class DatasetREADMESingleWriter:
             MORE_INFORMATION=self.MORE_INFORMATION,
         )
 
-#        yaml_header = self.get_yaml_header() + "\n"
-#        ret = yaml_header + ret
-
-        ret = ret.split("\n")
-        new_ret = ""
-        was_empty = True
-        for line in ret:
-            empty = len(line.strip()) == 0
-            if not empty or not was_empty:
-                new_ret += line.rstrip() + "\n"
-            was_empty = empty
-        ret = new_ret
-
-
-        return ret
+    def run(self):
+        self.context = self.gather_context()
+        # Render the template with the gathered information
+        return render_card(self.template, self.context)
+
+
+def error_message(e):
+    """The message recorded in error.log for an exception raised while processing a dataset.
+    File errors that are not about the dataset files are unexpected, and raised again."""
+    if isinstance(e, FileNotFoundError):
+        if e.filename == None or \
+            e.filename.endswith("dataset_infos.json") or \
+            "dummy_data" in e.filename:
+            return str(e)
+        raise e
+    if isinstance(e, OSError):
+        if "dummy_data" in str(e):
+            return str(e)
+        raise e
+    return str(e)
+
+
+def is_transient_error(e):
+    """Whether loading the dummy data failed for a reason that may go away on the next run (network, timeout, memory).
+    Other failures (missing dummy data, the assertions of check_splits, KeyError, ValueError...) happen again as long
+    as the dataset files and the generator are unchanged."""
+    import requests
+
+    return isinstance(e, (ConnectionError, TimeoutError, MemoryError, requests.RequestException))
+
+
+def gather_dataset_context(path, name, memprofile=False, profile_dir=None, **kwargs):
+    """Gather the render context of a dataset, which is the expensive part: this is what the worker processes run.
+    `kwargs` are passed to DatasetREADMESingleWriter.
+    Returns a dict with the context, the warnings string (None if there are none), whether the context can be cached,
+    the error message (None if it succeeded), the duration and the timings of the gathering stages, the peak RSS of the
+    process that ran it, and its memory profile if `memprofile` is set.
+    Only strings and JSON-like data are returned, so it can be sent between processes.
+    If `profile_dir` is given, the gathering runs under cProfile (in the process running it), see DatasetProfiler."""
+    if profile_dir is not None:
+        with DatasetProfiler(profile_dir, name):
+            return gather_dataset_context(path, name, memprofile=memprofile, **kwargs)
+    start = time.time()
+    result = dict(name=name, context=None, warnings=None, error=None, timings={})
+    memory_profile = DatasetMemoryProfile().start() if memprofile else None
+    try:
+        s = DatasetREADMESingleWriter(path, name, memory_profile=memory_profile, **kwargs)
+        result["context"] = s.gather_context()
+        if len(s.warnings) != 0:
+            result["warnings"] = str(s.warnings)
+        result["cacheable"] = s.cacheable
+        result["configs"] = [s.configs_requested, s.configs_built]
+    except Exception as e:
+        result["error"] = error_message(e)
+    else:
+        result["timings"] = s.timings
+    finally:
+        if memory_profile is not None:
+            result["memory"] = memory_profile.stop()
+    result["duration"] = time.time() - start
+    result["peak_rss"] = peak_rss()
+    return result
+
+
+def datasets_path():
+    dest_path = Path(__file__).parent / "datasets"
+    # Create the link to datasets/datasets directory
+    if not dest_path.exists():
+        import datasets
+        datasets_target = Path(datasets.__file__).parent.parent.parent / "datasets"
+        dest_path.symlink_to(datasets_target)
+
+    return dest_path.resolve()
+
+
+# The result of a dataset, as yielded by DatasetCardGenerator.generate: the card (None if it failed), the warnings
+# string (None if there are none), the error message (None if it succeeded), and the seconds spent in each stage
+CardResult = namedtuple("CardResult", ["name", "markdown", "warnings", "error", "timings"])
+
+
+class DatasetCardGenerator:
+    """Generate dataset cards in process: `generate` yields a CardResult for each dataset as soon as it is done.
+    Nothing is written but the context cache and the run journal (and the --profile outputs)."""
+
+    def __init__(
+        self,
+        seed="",
+        cache_dir=None,
+        use_cache=True,
+        retry_failed=False,
+        workers=1,
+        config_workers=1,
+        deduplicate_configs=True,
+        metrics=None,
+        memprofile=False,
+        profile=None,
+        profile_dir="profiles",
+        prefetch=8,
+        worker_initializer=None,
+        datasets_root=None,
+    ):
+        # Seed for the choice of the excerpt splits
+        self.seed = seed
+        cache_dir = cache_dir or Path(__file__).parent / ".cache"
+        # Also holds the caches of the providers
+        self.cache_dir = cache_dir
+        # Directory the builders and the dummy data are loaded from, ./datasets if not given
+        self.datasets_root = datasets_root
+        # Render contexts are stored in the cache, and reused when the dataset and the generator did not change
+        self.cache = ContextCache(cache_dir)
+        self.use_cache = use_cache
+        # Datasets that failed are not processed again until their inputs change, unless retry_failed is set
+        self.journal = RunJournal(cache_dir)
+        self.retry_failed = retry_failed
+        # Number of datasets processed concurrently (in worker processes), and of configs built concurrently for each
+        self.workers = workers
+        self.config_workers = config_workers
+        # Called in each worker process when it starts, and the pool of worker processes (see pool)
+        self.worker_initializer = worker_initializer
+        self.executor = None
+        self.deduplicate_configs = deduplicate_configs
+        # Number of datasets whose files are read (inputs hashed, cached context and dataset_infos.json loaded) ahead
+        # of the one being gathered, by a thread; 0 to read them when the dataset is processed
+        self.prefetch = prefetch
+        self.fingerprint = generator_fingerprint(seed=seed)
+        self.template = load_template()
+        # Number of configs whose dummy data was needed, and of dummy datasets actually built for them
+        self.configs_requested = 0
+        self.configs_built = 0
+        # Progress of the current run, if any
+        self.progress = None
+        # Run statistics (RunMetrics)
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        # Memory profile of each gathered dataset, if memprofile is set
+        self.memprofile = memprofile
+        self.memory_profiles = {}
+        # Datasets gathered under cProfile (never from the cache nor skipped as known failures), and where the
+        # profiles are written
+        self.profile = set(profile or [])
+        self.profile_dir = profile_dir
+
+    def log(self, *args):
+        pass
+
+    def pool(self):
+        """The pool of worker processes (None with a single worker), started on first use and kept until `close`, so
+        that the workers and the modules they imported stay warm from one run to the next (--watch).
+        The workers are spawned rather than forked: the prefetch, writer, progress and metrics threads of this
+        process may be holding locks when they start."""
+        if self.workers > 1 and self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.worker_initializer,
+            )
+        return self.executor
+
+    def close(self):
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def report(self, name, status, duration=None, cached=False):
+        if self.progress is not None:
+            self.progress.finish(name, status, duration, cached=cached)
+        self.metrics.observe_dataset(status, duration)
+
+    def prefetch_entry(self, entry):
+        """The file reads of a dataset, done ahead of time by the prefetch thread: hash its inputs, load its cached
+        context and parse its dataset_infos.json. Failures are left for the processing of the dataset to report."""
+        prefetched = dict(timings={})
+        if entry.skip_reason() is not None:
+            return prefetched
+        start = time.time()
+        key = entry.input_hash() + ":" + self.fingerprint
+        prefetched["timings"]["hash"] = time.time() - start
+        if self.use_cache and entry.name not in self.profile:
+            prefetched["cached"] = self.cache.load(entry.name, key)
+            if prefetched["cached"] is not None:
+                return prefetched
+        if entry.infos is not None:
+            try:
+                with open(entry.path / "dataset_infos.json") as f:
+                    prefetched["dataset_infos"] = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return prefetched
+
+    def prepare_entry(self, entry, prefetched):
+        """Handle a dataset as far as possible without gathering its context: ignored datasets, known failures,
+        cached contexts and prechecked failures. Returns its CardResult if done, else the task to run to gather its
+        context."""
+        k = entry.name
+        skip_reason = entry.skip_reason()
+        if skip_reason is not None:
+            self.log("IGNORING", k, f"({skip_reason})")
+            self.log("ERROR", k, skip_reason)
+            self.report(k, "skipped")
+            return CardResult(k, None, None, skip_reason, {})
+
+        self.metrics.observe_stages(prefetched["timings"])
+        key = entry.input_hash() + ":" + self.fingerprint
+        profiled = k in self.profile
+        if not self.retry_failed and not profiled:
+            previous_error = self.journal.failure(k, key)
+            self.metrics.cache_access("failures", previous_error is not None)
+            if previous_error is not None:
+                self.log("SKIPPING", k, "(failed with the same inputs in a previous run, use --retry-failed)")
+                self.report(k, "skipped")
+                return CardResult(k, None, None, previous_error, {})
+
+        self.log("PROCESSING", k)
+        cached = prefetched.get("cached")
+        if self.use_cache and not profiled:
+            self.metrics.cache_access("context", cached is not None)
+        if cached is not None:
+            return self.complete_entry(entry, key, cached, duration=None)
+
+        # Fail early, without loading the builder, when the dataset cannot succeed
+        start = time.time()
+        error, load_dummy_data, load_warning = precheck(entry, self.datasets_root)
+        self.metrics.observe_stages(dict(precheck=time.time() - start))
+        if error is not None:
+            return self.complete_entry(entry, key, dict(error=error_message(error)), duration=0.0)
+
+        kwargs = dict(
+            seed=self.seed,
+            load_dummy_data=load_dummy_data,
+            load_warning=load_warning,
+            config_workers=self.config_workers,
+            deduplicate_configs=self.deduplicate_configs,
+            memprofile=self.memprofile,
+            profile_dir=self.profile_dir if profiled else None,
+            dataset_infos=prefetched.get("dataset_infos"),
+            datasets_root=self.datasets_root,
+            cache_dir=self.cache_dir,
+        )
+        return dict(entry=entry, key=key, args=(entry.path, k), kwargs=kwargs)
 
+    def render(self, name, context, warnings, timings):
+        """The CardResult of a gathered context."""
+        start = time.time()
+        try:
+            markdown = render_card(self.template, context)
+            assert(len(markdown) != 0)
+            error = None
+        except Exception as e:
+            markdown = None
+            error = error_message(e)
+        timings = dict(timings, render=time.time() - start)
+        self.metrics.observe_stages(dict(render=timings["render"]))
+        return CardResult(name, markdown, warnings, error, timings)
+
+    def complete_entry(self, entry, key, result, duration):
+        """Record the result of a dataset (freshly gathered or from the cache) and render its card."""
+        k = entry.name
+        timings = result.get("timings", {})
+        self.metrics.observe_stages(timings)
+        if "memory" in result:
+            self.memory_profiles[k] = result["memory"]
+        if "configs" in result:
+            self.configs_requested += result["configs"][0]
+            self.configs_built += result["configs"][1]
+        if result.get("error") is not None:
+            card = CardResult(k, None, None, result["error"], timings)
+        else:
+            # A context taken from the cache has no duration
+            if duration is not None and result.get("cacheable", True):
+                self.cache.save(k, key, result["context"], result["warnings"])
+            card = self.render(k, result["context"], result["warnings"], timings)
+        if card.error is not None:
+            self.log("ERROR", k, card.error)
+
+        # A cached context keeps the duration of the run that gathered it
+        self.journal.record(k, key, error=card.error, duration=duration)
+        if card.error is not None:
+            self.report(k, "failed", duration)
+        else:
+            self.report(k, "done", duration, cached=duration is None)
+        return card
+
+    def generate(self, entries):
+        """Yield the CardResult of each of `entries` (DatasetEntry) as soon as it is done: in order when workers is
+        1, in order of completion otherwise.
+        The file reads of the next datasets are done by the prefetch thread meanwhile, and with worker processes, only
+        a few datasets per worker are submitted at a time, so that the prefetching stays just ahead of them."""
+        executor = self.pool()
+        futures = {}
+        try:
 
-class DatasetREADMEWriter:
-    def __init__(self):
+            def completed(futures, return_when):
+                done, _ = wait(futures, return_when=return_when)
+                for future in done:
+                    task = futures.pop(future)
+                    result = future.result()
+                    if result.get("peak_rss") is not None:
+                        self.metrics.observe_worker_rss(result["peak_rss"])
+                    yield self.complete_entry(task["entry"], task["key"], result, result["duration"])
+
+            for entry, prefetched in Prefetcher(entries, self.prefetch_entry, depth=self.prefetch):
+                task = self.prepare_entry(entry, prefetched)
+                if isinstance(task, CardResult):
+                    yield task
+                elif executor is None:
+                    result = gather_dataset_context(*task["args"], **task["kwargs"])
+                    yield self.complete_entry(entry, task["key"], result, result["duration"])
+                else:
+                    futures[executor.submit(gather_dataset_context, *task["args"], **task["kwargs"])] = task
+                    if len(futures) >= 2 * self.workers:
+                        yield from completed(futures, FIRST_COMPLETED)
+
+            while futures:
+                yield from completed(futures, FIRST_COMPLETED)
+        finally:
+            # Stopped early: the pool is kept, without the datasets nobody waits for anymore
+            for future in futures:
+                future.cancel()
+            self.journal.save()
+
+    def rerender(self, names):
+        """Yield the CardResult of each of `names` from its cached context only, without loading any dataset. Known
+        failures are yielded with their error, datasets without a cached context are left out."""
+        for k in names:
+            # Known failures have no up to date context: keep reporting them
+            error = self.journal.failure(k)
+            if error is not None:
+                yield CardResult(k, None, None, error, {})
+                continue
+            entry = self.cache.load(k)
+            if entry is None:
+                self.log("NO CACHED CONTEXT", k)
+                continue
+            self.log("RENDERING", k)
+            yield self.render(k, entry["context"], entry["warnings"], {})
+
+
+def generate_cards(paths, datasets_root="datasets", **kwargs):
+    """Generate the cards of the datasets at `paths`, yielding a CardResult (name, markdown, warnings, error, timings)
+    for each of them as soon as it is done. `kwargs` are passed to DatasetCardGenerator (workers=N to gather N datasets
+    concurrently).
+    `paths` are directories of `datasets_root` (the datasets directory of the datasets repository), relative to it
+    unless they are absolute, so that dataset names can be given. The builders and the dummy data are loaded from
+    `datasets_root`, whatever the current directory."""
+    datasets_root = Path(datasets_root).resolve()
+
+    def entries():
+        for path in paths:
+            path = datasets_root / path
+            if path.resolve().parent != datasets_root:
+                raise ValueError(f"{path} is not a dataset directory of {datasets_root}")
+            yield scan_dataset(path)
+
+    generator = DatasetCardGenerator(datasets_root=datasets_root, **kwargs)
+    try:
+        yield from generator.generate(entries())
+    finally:
+        generator.close()
+
+
+class DatasetREADMEWriter(DatasetCardGenerator):
+    """Write the README.md cards of the datasets repository, and error.log / warning.log in the current directory."""
+
+    def __init__(
+        self, metrics_file=None, metrics_interval=60, memprofile_file=None, write_queue=64, bundle=None, **kwargs
+    ):
+        # Run statistics, exported as an OpenMetrics textfile if metrics_file is given
+        metrics = RunMetrics(metrics_file, interval=metrics_interval)
+        super().__init__(metrics=metrics, memprofile=memprofile_file is not None, **kwargs)
+        # The memory report is written to memprofile_file if it is given
+        self.memprofile_file = memprofile_file
         self.errors = {}
         self.warnings = {}
+        # Number of README files actually written / left untouched because their content did not change
+        self.written = 0
+        self.unchanged = 0
+        # READMEs are written by a thread (AsyncWriter), with up to write_queue of them pending (0 to write them
+        # synchronously)
+        self.write_queue = write_queue
+        self.output = None
+        # Path of the bundle the cards are collected into (BundleWriter) instead of the datasets tree, if any
+        self.bundle_path = bundle
+        self.bundle = None
+
+    def log(self, *args):
+        if self.progress is not None:
+            self.progress.log(*args)
+        else:
+            print(*args)
 
     def dump_info(self, info, kind):
         info_keys = list(info.keys())
@@ -349,72 +873,339 @@ class DatasetREADMEWriter:
             for key in info_keys:
                 info_file.write(key + ":" + str(info[key]).replace("\n", "    ") + "\n")
 
-    def add_error(self, name, error):
-        print("ERROR", error)
-        self.errors[name] = str(error)
-
-    def add_warning(self, name, warnings):
-        self.warnings[name] = str(warnings)
-
-    def run(self, force=False, to_run = None):
-        dest_path = Path(__file__).parent / "datasets"
-        # Create the link to datasets/datasets directory
-        if not dest_path.exists():
-            datasets_target = Path(datasets.__file__).parent.parent.parent / "datasets"
-            dest_path.symlink_to(datasets_target)
-
-        dest_path = dest_path.resolve()
+    def datasets_path(self):
+        return datasets_path()
+
+    def write_card(self, dest_path, card):
+        """Record the errors and warnings of a CardResult, and write its README."""
+        if card.warnings is not None:
+            self.warnings[card.name] = card.warnings
+        if card.error is not None:
+            self.errors[card.name] = card.error
+            return
+        if self.bundle is not None:
+            self.bundle.add(card.name, card.markdown)
+        else:
+            self.output.write(dest_path / card.name / "README.md", card.markdown)
 
-        if to_run is None:
-            dir_list = os.listdir(dest_path.resolve())
+    def card_written(self, path, changed, duration=None):
+        # Called by the AsyncWriter thread, or by the BundleWriter
+        if changed:
+            self.written += 1
         else:
+            self.unchanged += 1
+        if duration is not None:
+            self.metrics.observe_stages(dict(write=duration))
+
+    @contextmanager
+    def writing(self):
+        """Write the READMEs through an AsyncWriter, waiting for the pending ones on exit, or collect them into the
+        bundle, written on exit."""
+        if self.bundle_path is not None:
+            self.bundle = BundleWriter(self.bundle_path, self.card_written)
+            try:
+                with self.bundle:
+                    yield
+            finally:
+                self.bundle = None
+            return
+        self.output = AsyncWriter(self.card_written, depth=self.write_queue)
+        try:
+            with self.output:
+                yield
+        finally:
+            self.output = None
+
+    def bundled_names(self):
+        """Names of the datasets that have a card in the bundle, or None if the cards are not bundled."""
+        if self.bundle_path is None:
+            return None
+        if not Path(self.bundle_path).exists():
+            return set()
+        return set(read_bundle(self.bundle_path))
+
+    def has_card(self, entry, bundled):
+        """Whether a dataset already has a card where the cards are written: in the bundle (whose dataset names are
+        `bundled`) in bundle mode, in the datasets tree otherwise."""
+        if bundled is not None:
+            return entry.name in bundled
+        return entry.readme is not None
+
+    def filter_entries(self, entries, force, explicit, bundled=None):
+        """Leave out the datasets that already have a card (unless `force`), and those that are not datasets
+        (they are errors only if they were asked for explicitly)."""
+        for entry in entries:
+            if not force and self.has_card(entry, bundled):
+                self.log("SKIPPING", entry.name)
+                self.report(entry.name, "skipped")
+                continue
+            if not explicit and entry.skip_reason() is not None:
+                self.log("IGNORING", entry.name, f"({entry.skip_reason()})")
+                self.report(entry.name, "skipped")
+                continue
+            yield entry
+
+    def expected_durations(self, entries, force, bundled=None):
+        """Expected processing time of each dataset: 0 for those that will be skipped, the duration of the previous
+        run for the others when known."""
+        expected = {}
+        for entry in entries:
+            if (not force and self.has_card(entry, bundled)) or entry.skip_reason() is not None:
+                expected[entry.name] = 0.0
+            elif self.journal.entries.get(entry.name, {}).get("duration") is not None:
+                expected[entry.name] = self.journal.entries[entry.name]["duration"]
+        return expected
+
+    def run_entries(self, dest_path, entries, force, explicit):
+        names = [entry.name for entry in entries]
+        bundled = None if force else self.bundled_names()
+        expected = self.expected_durations(entries, force, bundled)
+        self.progress = ProgressReporter(names, expected_durations=expected, workers=self.workers).start()
+        self.metrics.start()
+        entries = self.filter_entries(entries, force, explicit, bundled)
+        try:
+            with self.writing(), closing(self.generate(entries)) as cards:
+                for card in cards:
+                    self.write_card(dest_path, card)
+        finally:
+            self.progress.close()
+            self.progress = None
+            self.metrics.close()
+            if self.memprofile_file is not None:
+                with open(self.memprofile_file, "w") as f:
+                    f.write(memory_report(self.memory_profiles))
+
+    def rerender_names(self, dest_path, to_run=None):
+        """The datasets whose README can be rebuilt from the cache: those of `to_run` (all the known ones if it is not
+        given) still in the repository, and the known failures."""
+        dir_list = list(to_run) if to_run is not None else sorted(set(self.cache.names()) | set(self.journal.entries))
+        dir_list.sort()
+        names = [k for k in dir_list if (dest_path / k).is_dir() or self.journal.failure(k) is not None]
+        for k in sorted(set(dir_list) - set(names)):
+            self.log("NO CACHED CONTEXT", k)
+        return names
+
+    def rerender_cards(self, dest_path, names):
+        """Rebuild the READMEs of `names` from the cached contexts only, without loading any dataset."""
+        with self.writing():
+            for card in self.rerender(names):
+                self.write_card(dest_path, card)
+
+    def run(
+        self,
+        force=False,
+        to_run = None,
+        rerender_only=False,
+        include=None,
+        exclude=None,
+        changed_since=None,
+        generator_changed_since=None,
+    ):
+        dest_path = self.datasets_path()
+
+        if changed_since is not None:
+            # Only the datasets touched since this git revision (all of them if the generator changed since
+            # generator_changed_since), among those of to_run if given
+            changed = changed_datasets(dest_path, changed_since, generator_changed_since)
             force = True
-            dir_list = to_run
+            if changed is None:
+                print("Generator or template changed since", generator_changed_since, ": processing every dataset")
+            else:
+                print(len(changed), "dataset(s) changed since", changed_since)
+                to_run = changed if to_run is None else [name for name in to_run if name in changed]
 
-        dir_list.sort()
+        if rerender_only:
+            self.rerender_cards(dest_path, self.rerender_names(dest_path, to_run))
+        else:
+            if to_run is not None:
+                force = True
 
-        for i, k in enumerate(dir_list):
-            try:
-                dest_file = dest_path / k  / "README.md"
-                if dest_file.exists() and not force :
-                    print("SKIPPING", k)
-                    continue
-                print("PROCESSING", k)
-                
-                s = DatasetREADMESingleWriter(dest_path / k, k)
-                processed = s.run()
-
-                if len(s.warnings) != 0:
-                    self.add_warning(k, s.warnings)
-
-                assert(len(processed) != 0)
-                with dest_file.open("w") as readme_file:
-                    readme_file.write(processed)
-
-            except FileNotFoundError as e:
-                if e.filename == None or \
-                    e.filename.endswith("dataset_infos.json") or \
-                    "dummy_data" in e.filename:
-                    self.add_error(k, e)
-                else:
-                    raise
-            except OSError as e:
-                if "dummy_data" in str(e):
-                    self.add_error(k, e)
-                else:
-                    raise
-            except Exception as e :
-                self.add_error(k, e)
+            entries = discover_datasets(dest_path, names=to_run, include=include, exclude=exclude)
+            self.run_entries(dest_path, entries, force, explicit=to_run is not None)
 
         self.dump_info(self.errors, "error")
         self.dump_info(self.warnings, "warning")
 
+        if self.bundle_path is not None:
+            print(f"Cards bundled in {self.bundle_path}: {self.written} new or changed, {self.unchanged} unchanged")
+        else:
+            print(f"README files: {self.written} written, {self.unchanged} unchanged")
+        if self.configs_built != 0:
+            ratio = self.configs_requested / self.configs_built
+            print(
+                f"Configs: {self.configs_built} dummy datasets built for {self.configs_requested} configs "
+                f"(dedup ratio {ratio:.2f})"
+            )
+
 
 def main():
-    import sys
-    d = DatasetREADMEWriter()
-    to_run = sys.argv[1:] or None
-    d.run(to_run = to_run)
+    import argparse
+    parser = argparse.ArgumentParser(description="Create the README.md dataset cards of the datasets repository.")
+    parser.add_argument("datasets", nargs="*", help="datasets to (re)create, all missing READMEs if not given")
+    parser.add_argument("--seed", default="", help="seed for the choice of the excerpt split of each config")
+    parser.add_argument("--cache-dir", default=None, help="directory of the render context cache (default: .cache)")
+    parser.add_argument("--no-cache", action="store_true", help="gather every context again, ignoring the cache")
+    parser.add_argument(
+        "--rerender-only",
+        action="store_true",
+        help="rebuild the READMEs from the cached contexts only (after a template change), without loading datasets",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="PATTERN",
+        help="only process datasets matching this glob (or 're:' prefixed regex) pattern, can be repeated",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="skip datasets matching this glob (or 're:' prefixed regex) pattern, can be repeated",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="process again the datasets that failed in a previous run even if their files did not change",
+    )
+    parser.add_argument(
+        "--changed-since",
+        metavar="REV",
+        help="only (re)create the READMEs of the datasets whose files changed since this git revision",
+    )
+    parser.add_argument(
+        "--generator-changed-since",
+        metavar="REV",
+        help="--changed-since: process every dataset if the generator code or the template changed since this "
+        "revision of the generator repository",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="number of datasets processed in parallel")
+    parser.add_argument(
+        "--config-workers", type=int, default=1, help="number of configs of a dataset built concurrently (threads)"
+    )
+    parser.add_argument(
+        "--no-config-dedup",
+        action="store_true",
+        help="build every config, even those sharing the same dummy data, features and builder kwargs",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="write the run statistics to this OpenMetrics textfile (for node_exporter's textfile collector)",
+    )
+    parser.add_argument(
+        "--metrics-interval", type=float, default=60, help="seconds between two updates of the metrics file"
+    )
+    parser.add_argument(
+        "--memprofile",
+        nargs="?",
+        const="memprofile.log",
+        metavar="PATH",
+        help="profile the memory used by each gathered dataset and each stage (tracemalloc and RSS), and write a "
+        "ranked report to PATH (default: memprofile.log); use with --no-cache to profile every dataset",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="NAME[,NAME...]",
+        help="gather these datasets (only them if no datasets are given) under cProfile, writing NAME.pstats and "
+        "NAME.collapsed (collapsed stacks for flame graphs) to --profile-dir",
+    )
+    parser.add_argument("--profile-dir", default="profiles", help="directory of the --profile outputs")
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=8,
+        help="number of datasets whose files are read ahead of the one being processed (0 to disable)",
+    )
+    parser.add_argument(
+        "--write-queue",
+        type=int,
+        default=64,
+        help="number of READMEs waiting to be written by the writer thread (0 to write them synchronously)",
+    )
+    parser.add_argument(
+        "--bundle",
+        metavar="PATH",
+        help="collect the cards into this bundle (JSON lines with the name, sha256 and card of each dataset, gzipped "
+        "if PATH ends with .gz) instead of writing them into the datasets tree; an existing bundle is updated",
+    )
+    parser.add_argument(
+        "--unpack",
+        metavar="PATH",
+        help="write the cards of this bundle as the READMEs of the datasets tree, and exit",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="after the run, keep regenerating the cards of the datasets whose files change (all the cached ones "
+        "when the template changes) until interrupted",
+    )
+    parser.add_argument(
+        "--debounce", type=float, default=0.2, help="--watch: seconds without changes before regenerating"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="--watch: seconds between two scans of the datasets when watchdog is not installed",
+    )
+    args = parser.parse_args()
+    profile = args.profile.split(",") if args.profile else []
+    if args.datasets:
+        not_run = [name for name in profile if name not in args.datasets]
+        if not_run:
+            parser.error(f"--profile: {', '.join(not_run)} not in the datasets to process")
+
+    d = DatasetREADMEWriter(
+        seed=args.seed,
+        cache_dir=args.cache_dir,
+        use_cache=not args.no_cache,
+        retry_failed=args.retry_failed,
+        workers=args.workers,
+        config_workers=args.config_workers,
+        deduplicate_configs=not args.no_config_dedup,
+        metrics_file=args.metrics_file,
+        metrics_interval=args.metrics_interval,
+        memprofile_file=args.memprofile,
+        profile=profile,
+        profile_dir=args.profile_dir,
+        prefetch=args.prefetch,
+        write_queue=args.write_queue,
+        bundle=args.bundle,
+    )
+    if args.unpack is not None:
+        written, unchanged = unpack_bundle(args.unpack, d.datasets_path())
+        print(f"README files: {written} written, {unchanged} unchanged")
+        return
+    if args.generator_changed_since is not None and args.changed_since is None:
+        parser.error("--generator-changed-since requires --changed-since")
+    to_run = args.datasets or profile or None
+    # The worker pool is kept from the first run through the --watch session
+    try:
+        try:
+            d.run(
+                to_run = to_run,
+                rerender_only=args.rerender_only,
+                include=args.include,
+                exclude=args.exclude,
+                changed_since=args.changed_since,
+                generator_changed_since=args.generator_changed_since,
+            )
+        except GitError as e:
+            parser.exit(1, f"{parser.prog}: error: {e}\n")
+        if args.watch:
+            from watch import watch
+
+            watch(
+                d,
+                d.datasets_path(),
+                to_run=args.datasets or None,
+                include=args.include,
+                exclude=args.exclude,
+                debounce=args.debounce,
+                poll_interval=args.poll_interval,
+            )
+    finally:
+        d.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,174 @@
+import os
+import threading
+import tracemalloc
+
+from utils import peak_rss
+
+
+# Number of allocation sites kept for each stage
+TOP_SITES = 10
+
+
+def current_rss():
+    """Resident set size of this process in bytes, None when it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    # Only the peak is available: better than nothing
+    return peak_rss()
+
+
+def format_bytes(size):
+    if size is None:
+        return "?"
+    sign = "-" if size < 0 else ""
+    size = abs(size)
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{sign}{size:.0f}{unit}" if unit == "B" else f"{sign}{size:.1f}{unit}"
+        size /= 1024
+    return f"{sign}{size:.1f}GiB"
+
+
+def top_sites(snapshot, base_snapshot, limit=TOP_SITES):
+    """The allocation sites that grew the most between two tracemalloc snapshots."""
+    # Leave out the snapshots themselves
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    snapshot = snapshot.filter_traces(filters)
+    base_snapshot = base_snapshot.filter_traces(filters)
+    stats = snapshot.compare_to(base_snapshot, "lineno")
+    stats = [stat for stat in stats if stat.size_diff > 0][:limit]
+    return [
+        dict(site=f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", size=stat.size_diff, count=stat.count_diff)
+        for stat in stats
+    ]
+
+
+class DatasetMemoryProfile:
+    """Memory profile of the gathering of a dataset: peak and retained memory, as traced by tracemalloc (Python
+    allocations) and as seen by the OS (RSS, which includes the Arrow buffers), for the whole dataset and each stage.
+    Stages can be nested: the peak of a nested stage also counts for the enclosing ones."""
+
+    def __init__(self, sample_interval=0.05):
+        self.sample_interval = sample_interval
+        self.stages = {}
+        self.open_stages = []
+        self.lock = threading.Lock()
+        self.rss_peak = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        rss = current_rss()
+        if rss is None:
+            return
+        with self.lock:
+            if self.rss_peak is None or rss > self.rss_peak:
+                self.rss_peak = rss
+
+    def sampler(self):
+        while not self.stopped.wait(self.sample_interval):
+            self.sample()
+
+    def fold_peaks(self):
+        """Account the peaks seen since the last call to every open stage, and start measuring new peaks."""
+        self.sample()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        with self.lock:
+            rss_peak = self.rss_peak
+            self.rss_peak = None
+        for record in self.open_stages:
+            record["traced_peak"] = max(record["traced_peak"], traced_peak - record["traced_start"])
+            if rss_peak is not None and record["rss_start"] is not None:
+                record["rss_peak"] = max(record["rss_peak"], rss_peak - record["rss_start"])
+        tracemalloc.reset_peak()
+
+    def start(self):
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.rss_start = current_rss()
+        self.enter("total")
+        self.thread = threading.Thread(target=self.sampler, daemon=True)
+        self.thread.start()
+        return self
+
+    def enter(self, name):
+        self.fold_peaks()
+        record = dict(
+            name=name,
+            traced_start=tracemalloc.get_traced_memory()[0],
+            traced_peak=0,
+            rss_start=current_rss(),
+            rss_peak=0,
+            snapshot=tracemalloc.take_snapshot(),
+        )
+        self.open_stages.append(record)
+
+    def exit(self, name):
+        self.fold_peaks()
+        record = self.open_stages.pop()
+        assert record["name"] == name
+        rss_end = current_rss()
+        snapshot = tracemalloc.take_snapshot()
+        stage = self.stages.setdefault(
+            name, dict(traced_peak=0, traced_retained=0, rss_peak=0, rss_retained=0, calls=0, top_sites=[])
+        )
+        stage["calls"] += 1
+        stage["traced_peak"] = max(stage["traced_peak"], record["traced_peak"])
+        stage["traced_retained"] += tracemalloc.get_traced_memory()[0] - record["traced_start"]
+        if rss_end is not None and record["rss_start"] is not None:
+            stage["rss_peak"] = max(stage["rss_peak"], record["rss_peak"])
+            stage["rss_retained"] += rss_end - record["rss_start"]
+        # Keep the allocation sites of the call with the highest peak
+        if stage["traced_peak"] == record["traced_peak"]:
+            stage["top_sites"] = top_sites(snapshot, record["snapshot"])
+
+    def stop(self):
+        """Stop profiling, and return the profile as JSON-like data (it is sent back from the worker processes)."""
+        # Stages left open by an exception
+        while len(self.open_stages) > 1:
+            self.exit(self.open_stages[-1]["name"])
+        self.exit("total")
+        self.stopped.set()
+        self.thread.join()
+        if self.started_tracing:
+            tracemalloc.stop()
+        total = self.stages.pop("total")
+        return dict(rss_start=self.rss_start, total=total, stages=self.stages)
+
+
+def memory_report(profiles, worst=5):
+    """Text report of the memory profiles of a run ({dataset name: profile}), datasets ranked by peak memory (RSS
+    when known, since it includes the Arrow buffers that tracemalloc does not see), with the stages and the top
+    allocation sites of the `worst` first ones."""
+
+    def peak(item):
+        total = item[1]["total"]
+        return max(total["rss_peak"], total["traced_peak"])
+
+    ranked = sorted(profiles.items(), key=lambda item: (-peak(item), item[0]))
+    lines = [
+        f"{'dataset':40} {'rss peak':>10} {'rss kept':>10} {'py peak':>10} {'py kept':>10} {'rss start':>10}",
+    ]
+    for name, profile in ranked:
+        total = profile["total"]
+        lines.append(
+            f"{name:40} {format_bytes(total['rss_peak']):>10} {format_bytes(total['rss_retained']):>10} "
+            f"{format_bytes(total['traced_peak']):>10} {format_bytes(total['traced_retained']):>10} "
+            f"{format_bytes(profile['rss_start']):>10}"
+        )
+
+    for name, profile in ranked[:worst]:
+        lines += ["", f"== {name}"]
+        for stage_name, stage in sorted(profile["stages"].items(), key=lambda item: -item[1]["traced_peak"]):
+            lines.append(
+                f"  {stage_name:12} rss peak {format_bytes(stage['rss_peak'])}, rss kept {format_bytes(stage['rss_retained'])}, "
+                f"py peak {format_bytes(stage['traced_peak'])}, py kept {format_bytes(stage['traced_retained'])}"
+                f" ({stage['calls']} call(s))"
+            )
+            for site in stage["top_sites"]:
+                lines.append(f"      {format_bytes(site['size']):>10} {site['count']:>8} blocks  {site['site']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import defaultdict
+
+from utils import peak_rss, write_if_changed
+
+
+PREFIX = "readme_generator"
+
+DURATION_BUCKETS = [0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0]
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels=""):
+        separator = "," if labels else ""
+        lines = []
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class RunMetrics:
+    """Statistics of a run, written as an OpenMetrics textfile (for node_exporter's textfile collector) at the end of
+    the run, and every `interval` seconds during it by a timer thread (see start), even while a long dataset is being
+    processed. The observe methods can be called from several threads."""
+
+    def __init__(self, path=None, interval=60):
+        self.path = path
+        self.lock = threading.Lock()
+        self.interval = interval
+        self.start_time = time.time()
+        self.stopped = threading.Event()
+        self.thread = None
+        # Number of datasets by status (done, skipped, failed)
+        self.datasets = defaultdict(int)
+        self.dataset_durations = Histogram()
+        self.stage_durations = defaultdict(Histogram)
+        # Cache name -> [hits, misses]
+        self.cache_accesses = defaultdict(lambda: [0, 0])
+        # Largest peak RSS reported by a worker process (see observe_worker_rss)
+        self.worker_peak_rss = 0
+
+    def observe_dataset(self, status, duration=None):
+        with self.lock:
+            self.datasets[status] += 1
+            if duration is not None:
+                self.dataset_durations.observe(duration)
+
+    def observe_stages(self, timings):
+        with self.lock:
+            for stage, duration in timings.items():
+                self.stage_durations[stage].observe(duration)
+
+    def cache_access(self, cache, hit):
+        with self.lock:
+            self.cache_accesses[cache][0 if hit else 1] += 1
+
+    def observe_worker_rss(self, rss):
+        """Record the peak RSS of a worker process, sent back with each dataset it gathered: rusage only accounts for
+        the child processes once they exited, and the worker processes live as long as the run."""
+        with self.lock:
+            self.worker_peak_rss = max(self.worker_peak_rss, rss)
+
+    def render(self):
+        with self.lock:
+            return self.render_locked()
+
+    def render_locked(self):
+        lines = []
+
+        name = f"{PREFIX}_datasets"
+        lines += [f"# TYPE {name} counter", f"# HELP {name} Datasets handled by the run, by status."]
+        for status in ["done", "skipped", "failed"]:
+            lines.append(f'{name}_total{{status="{status}"}} {self.datasets[status]}')
+
+        name = f"{PREFIX}_dataset_duration_seconds"
+        lines += [f"# TYPE {name} histogram", f"# HELP {name} Time spent gathering the context of a dataset."]
+        lines += self.dataset_durations.samples(name)
+
+        name = f"{PREFIX}_stage_duration_seconds"
+        lines += [f"# TYPE {name} histogram", f"# HELP {name} Time spent in each processing stage of a dataset."]
+        for stage in sorted(self.stage_durations):
+            lines += self.stage_durations[stage].samples(name, f'stage="{stage}"')
+
+        name = f"{PREFIX}_cache_requests"
+        lines += [f"# TYPE {name} counter", f"# HELP {name} Cache lookups, by cache and result."]
+        for cache in sorted(self.cache_accesses):
+            hits, misses = self.cache_accesses[cache]
+            lines.append(f'{name}_total{{cache="{cache}",result="hit"}} {hits}')
+            lines.append(f'{name}_total{{cache="{cache}",result="miss"}} {misses}')
+
+        name = f"{PREFIX}_cache_hit_ratio"
+        lines += [f"# TYPE {name} gauge", f"# HELP {name} Ratio of cache lookups that were hits."]
+        for cache in sorted(self.cache_accesses):
+            hits, misses = self.cache_accesses[cache]
+            ratio = hits / (hits + misses) if hits + misses != 0 else 0.0
+            lines.append(f'{name}{{cache="{cache}"}} {ratio}')
+
+        # Not available on Windows: no peak RSS metrics there
+        if peak_rss() is not None:
+            name = f"{PREFIX}_peak_rss_bytes"
+            lines += [
+                f"# TYPE {name} gauge",
+                f"# HELP {name} Peak resident set size of the main process, and of the largest worker process as of "
+                "the last dataset it finished.",
+            ]
+            lines.append(f'{name}{{process="main"}} {peak_rss()}')
+            workers = max(self.worker_peak_rss, peak_rss(children=True))
+            lines.append(f'{name}{{process="workers"}} {workers}')
+
+        name = f"{PREFIX}_run_duration_seconds"
+        lines += [f"# TYPE {name} gauge", f"# HELP {name} Time elapsed since the start of the run."]
+        lines.append(f"{name} {time.time() - self.start_time}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Write the textfile (atomically, as the textfile collector requires), if a path was given."""
+        if self.path is None:
+            return
+        write_if_changed(self.path, self.render())
+
+    def tick(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start(self):
+        """Write the textfile every `interval` seconds until `close`."""
+        if self.path is not None and self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.tick, daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        """Stop the timer, and write the final statistics."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.write()
@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+
+from utils import write_if_changed
+
+# Marks the end of a queue
+_DONE = object()
+
+
+def _put(q, item, stopped):
+    """Put `item` in the bounded queue `q`, unless `stopped` is set while waiting for room."""
+    while not stopped.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class Prefetcher:
+    """Iterate over the items of `iterable` with the result of `function` on each of them, as (item, result) pairs:
+    a thread runs `function` (the file reads of a dataset) up to `depth` items ahead of the consumer (the compute
+    stage), so that they are done by the time the consumer gets there. With a depth of 0, everything runs in the
+    consumer thread. Exceptions of the thread are raised again in the consumer."""
+
+    def __init__(self, iterable, function, depth=8):
+        self.iterable = iterable
+        self.function = function
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def produce(self):
+        try:
+            for item in self.iterable:
+                if not _put(self.queue, (item, self.function(item), None), self.stopped):
+                    return
+        except BaseException as e:
+            _put(self.queue, (None, None, e), self.stopped)
+        _put(self.queue, _DONE, self.stopped)
+
+    def __iter__(self):
+        if self.depth == 0:
+            for item in self.iterable:
+                yield item, self.function(item)
+            return
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+        try:
+            while True:
+                entry = self.queue.get()
+                if entry is _DONE:
+                    return
+                item, result, error = entry
+                if error is not None:
+                    raise error
+                yield item, result
+        finally:
+            self.stopped.set()
+            self.thread.join()
+
+
+class AsyncWriter:
+    """Write files with write_if_changed in a thread, through a queue of at most `depth` pending files, so that the
+    compute stage does not wait for the disk. `callback(path, changed, duration)` is called in that thread after each
+    write. Errors are raised again by the next `write` or by `close`. With a depth of 0, files are written
+    synchronously."""
+
+    def __init__(self, callback=None, depth=64):
+        self.callback = callback
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.error = None
+        self.thread = None
+        if depth != 0:
+            self.thread = threading.Thread(target=self.consume, daemon=True)
+            self.thread.start()
+
+    def write_file(self, path, content):
+        start = time.time()
+        changed = write_if_changed(path, content)
+        if self.callback is not None:
+            self.callback(path, changed, time.time() - start)
+
+    def consume(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if self.error is not None:
+                # Drain the queue without writing anything more
+                continue
+            try:
+                self.write_file(*item)
+            except BaseException as e:
+                self.error = e
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, path, content):
+        if self.thread is None:
+            self.write_file(path, content)
+            return
+        self.raise_error()
+        self.queue.put((path, content))
+
+    def close(self):
+        """Wait for the pending files to be written."""
+        if self.thread is not None:
+            self.queue.put(_DONE)
+            self.thread.join()
+            self.thread = None
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the exception being raised
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
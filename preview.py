@@ -0,0 +1,275 @@
+"""Serve the cards of the datasets repository on demand, to preview a card while working on a dataset:
+
+    python preview.py [--port 8000]
+    curl http://localhost:8000/card/NAME
+
+The runtime stays warm between requests, and the gathered contexts of the recently previewed datasets are kept in
+memory until one of their files changes: only the template is rendered again when nothing changed.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import closing
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from discovery import scan_dataset
+from main import CardResult, DatasetCardGenerator, datasets_path, load_template, render_card
+
+TEMPLATE_FILE = Path(__file__).parent / "README.template.md"
+
+# Number of requests the latency percentiles of /stats are computed on
+LATENCY_WINDOW = 1000
+
+
+def files_signature(entry):
+    """Hash of the path, size and modification time of the input files of a dataset: it changes as soon as one of
+    them is written, without reading them."""
+    h = hashlib.sha256()
+    for relative_path in sorted(entry.input_files()):
+        stat = entry.files[relative_path]
+        h.update(f"{relative_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ContextLRU:
+    """Render contexts of the recently previewed datasets, with the signature of the files they were gathered from.
+    The least recently used ones are dropped when the total size of their JSON exceeds `max_bytes`."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # Name -> (signature, context, warnings, size), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+    def get(self, name, signature):
+        """The (context, warnings) of a dataset, or None if it is not cached or its files changed since."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            if entry[0] != signature:
+                self._remove(name)
+                return None
+            self.entries.move_to_end(name)
+            return entry[1], entry[2]
+
+    def put(self, name, signature, context, warnings):
+        size = len(json.dumps(context, ensure_ascii=False)) + len(warnings or "")
+        with self.lock:
+            self._remove(name)
+            if size > self.max_bytes:
+                return
+            self.entries[name] = (signature, context, warnings, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted[3]
+                self.evictions += 1
+
+
+class CardPreviewer(DatasetCardGenerator):
+    """Render the card of a dataset of `root` on demand. Contexts come from the in-memory LRU when the files of the
+    dataset did not change, and are gathered in process otherwise (from the context cache when possible)."""
+
+    def __init__(self, root, max_bytes=64 << 20, **kwargs):
+        super().__init__(**kwargs)
+        self.root = Path(root).resolve()
+        self.contexts = ContextLRU(max_bytes)
+        # The dummy data loader is not thread safe: one dataset is gathered at a time
+        self.gather_lock = threading.Lock()
+        self.gathered = None
+        self.template_mtime = TEMPLATE_FILE.stat().st_mtime_ns
+        self.stats_lock = threading.Lock()
+        self.counts = dict(requests=0, hits=0, misses=0, errors=0)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def render(self, name, context, warnings, timings):
+        # Every context goes through here, from the context cache or freshly gathered
+        self.gathered = (context, warnings)
+        return super().render(name, context, warnings, timings)
+
+    def reload_template(self):
+        """Load the template again if it was edited."""
+        mtime = TEMPLATE_FILE.stat().st_mtime_ns
+        if mtime != self.template_mtime:
+            self.template = load_template()
+            self.template_mtime = mtime
+
+    def card(self, name):
+        """Returns the CardResult of a dataset and whether its context came from the LRU, or None if there is no such
+        dataset directory."""
+        start = time.time()
+        path = self.root / name
+        if path.resolve().parent != self.root or not path.is_dir():
+            return None, False
+        entry = scan_dataset(path)
+        signature = files_signature(entry)
+        self.reload_template()
+        timings = dict(scan=time.time() - start)
+
+        cached = self.contexts.get(name, signature)
+        if cached is not None:
+            context, warnings = cached
+            start = time.time()
+            markdown = render_card(self.template, context)
+            timings["render"] = time.time() - start
+            card = CardResult(name, markdown, warnings, None, timings)
+        else:
+            with self.gather_lock:
+                self.gathered = None
+                with closing(self.generate([entry])) as cards:
+                    card = next(cards)
+                if card.error is None and self.gathered is not None:
+                    self.contexts.put(name, signature, *self.gathered)
+            card = card._replace(timings=dict(timings, **card.timings))
+
+        with self.stats_lock:
+            self.counts["requests"] += 1
+            self.counts["hits" if cached is not None else "misses"] += 1
+            if card.error is not None:
+                self.counts["errors"] += 1
+        return card, cached is not None
+
+    def observe_latency(self, latency):
+        with self.stats_lock:
+            self.latencies.append(latency)
+
+    def stats(self):
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else None
+
+        lookups = counts["hits"] + counts["misses"]
+        return dict(
+            counts,
+            hit_ratio=counts["hits"] / lookups if lookups else None,
+            latency_p50=percentile(0.5),
+            latency_p95=percentile(0.95),
+            latency_max=latencies[-1] if latencies else None,
+            contexts=len(self.contexts),
+            context_bytes=self.contexts.size,
+            context_max_bytes=self.contexts.max_bytes,
+            evictions=self.contexts.evictions,
+        )
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """GET /card/NAME returns the card of a dataset (X-Cache tells whether its context was in memory, Server-Timing
+    how long each stage took), GET /stats the counters and latencies of the server as JSON."""
+
+    cache_status = "-"
+
+    def send_body(self, status, body, content_type, headers=None):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.start = time.time()
+        path = unquote(urlsplit(self.path).path)
+        previewer = self.server.previewer
+        if path == "/stats":
+            self.send_body(HTTPStatus.OK, json.dumps(previewer.stats(), indent=2) + "\n", "application/json")
+            return
+        if not path.startswith("/card/"):
+            self.send_body(HTTPStatus.NOT_FOUND, "Use /card/NAME or /stats\n", "text/plain; charset=utf-8")
+            return
+
+        name = path[len("/card/"):]
+        card, hit = previewer.card(name)
+        if card is None:
+            self.send_body(HTTPStatus.NOT_FOUND, f"No dataset {name}\n", "text/plain; charset=utf-8")
+            return
+        latency = time.time() - self.start
+        previewer.observe_latency(latency)
+        self.cache_status = "hit" if hit else "miss"
+        timings = dict(card.timings, total=latency)
+        headers = {
+            "X-Cache": self.cache_status,
+            "Server-Timing": ", ".join(f"{stage};dur={duration * 1000:.1f}" for stage, duration in timings.items()),
+        }
+        if card.warnings is not None:
+            # Header values must be latin-1 on a single line
+            headers["X-Card-Warnings"] = json.dumps(card.warnings)
+        if card.error is not None:
+            self.send_body(HTTPStatus.INTERNAL_SERVER_ERROR, card.error + "\n", "text/plain; charset=utf-8", headers)
+        else:
+            self.send_body(HTTPStatus.OK, card.markdown, "text/markdown; charset=utf-8", headers)
+
+    def log_request(self, code="-", size="-"):
+        latency = (time.time() - self.start) * 1000 if hasattr(self, "start") else 0.0
+        code = getattr(code, "value", code)
+        self.log_message('"%s" %s %s %.1fms', self.requestline, code, self.cache_status, latency)
+
+
+def make_server(host="127.0.0.1", port=8000, root=None, **kwargs):
+    """The preview HTTP server (serve_forever to run it); `kwargs` are passed to CardPreviewer."""
+    server = ThreadingHTTPServer((host, port), PreviewHandler)
+    server.daemon_threads = True
+    server.previewer = CardPreviewer(root if root is not None else datasets_path(), **kwargs)
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument(
+        "--max-context-mb", type=float, default=64, help="size of the gathered contexts kept in memory (MiB of JSON)"
+    )
+    parser.add_argument("--seed", default="", help="seed for the choice of the excerpt split of each config")
+    parser.add_argument("--cache-dir", default=None, help="directory of the render context cache (default: .cache)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the render context cache on disk")
+    parser.add_argument(
+        "--config-workers", type=int, default=1, help="number of configs of a dataset built concurrently (threads)"
+    )
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        max_bytes=int(args.max_context_mb * (1 << 20)),
+        seed=args.seed,
+        cache_dir=args.cache_dir,
+        use_cache=not args.no_cache,
+        # Dataset authors fix the failures they preview
+        retry_failed=True,
+        config_workers=args.config_workers,
+    )
+    host, port = server.server_address[:2]
+    print(f"Serving the cards on http://{host}:{port}/card/NAME (statistics on /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
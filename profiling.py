@@ -0,0 +1,82 @@
+import cProfile
+import os
+import pstats
+from pathlib import Path
+
+
+# Paths of the call graph worth less than this fraction of the total time are dropped from the collapsed stacks: the
+# number of paths grows exponentially with the depth of the call graph otherwise
+MIN_STACK_FRACTION = 1e-3
+MAX_STACK_DEPTH = 256
+
+
+def frame_name(func):
+    filename, line, name = func
+    if filename == "~":
+        # Built-in function, like "<method 'read' of '_io.BufferedReader' objects>"
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+
+def collapsed_stacks(stats):
+    """Collapsed stacks ("frame;frame;...;frame microseconds" lines, as read by flamegraph.pl, inferno or speedscope)
+    from pstats.Stats. cProfile only records caller/callee pairs, so the time of a function called from several places
+    is split between its callers in proportion of the time spent in it from each of them."""
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, cumulative))
+    # Functions called from outside the profile only, or from themselves (the first call of a recursion)
+    roots = [func for func, (_, _, _, _, callers) in stats.stats.items() if set(callers) <= {func}]
+
+    min_time = MIN_STACK_FRACTION * sum(stats.stats[root][3] for root in roots)
+    totals = {}
+
+    def visit(func, stack, factor):
+        _, _, own, cumulative, _ = stats.stats[func]
+        own *= factor
+        stack = stack + [func]
+        children = callees.get(func, [])
+        # With recursion, the time recorded for the calls of a function can add up to more than its cumulative time
+        children_time = sum(edge_cumulative for _, edge_cumulative in children)
+        scale = min(1.0, (cumulative - stats.stats[func][2]) / children_time) if children_time > 0 else 0.0
+        for callee, edge_cumulative in children:
+            callee_cumulative = stats.stats[callee][3]
+            if callee_cumulative == 0:
+                continue
+            edge_time = edge_cumulative * scale * factor
+            # Recursive calls, paths too deep and paths worth too little are counted in the time of the caller, so
+            # that the stacks still add up to the total time
+            if callee in stack or len(stack) >= MAX_STACK_DEPTH or edge_time < min_time:
+                own += edge_time
+            else:
+                visit(callee, stack, edge_time / callee_cumulative)
+        if own > 0:
+            key = ";".join(frame_name(frame) for frame in stack)
+            totals[key] = totals.get(key, 0.0) + own
+
+    for root in sorted(roots):
+        visit(root, [], 1.0)
+    return "".join(f"{key} {round(value * 1e6)}\n" for key, value in sorted(totals.items()) if round(value * 1e6) > 0)
+
+
+class DatasetProfiler:
+    """Runs the gathering of a dataset under cProfile, and writes NAME.pstats (for pstats or snakeviz) and
+    NAME.collapsed (collapsed stacks for flame graphs) to `profile_dir`."""
+
+    def __init__(self, profile_dir, name):
+        self.profile_dir = Path(profile_dir)
+        self.name = name
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.profile.dump_stats(self.profile_dir / f"{self.name}.pstats")
+        with open(self.profile_dir / f"{self.name}.collapsed", "w") as f:
+            f.write(collapsed_stacks(pstats.Stats(self.profile)))
+        return False
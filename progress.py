@@ -0,0 +1,117 @@
+import sys
+import threading
+import time
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    return f"{minutes}m{seconds:02d}s"
+
+
+class ProgressReporter:
+    """Done (of which from the context cache)/skipped/failed counts, throughput and ETA of a run.
+    When the stream is a TTY, a status line is redrawn in place (messages go through `log` to be printed above it),
+    otherwise a status line is printed every `interval` seconds.
+    The ETA uses the expected duration of each remaining dataset (from previous runs) when known, and the mean
+    duration observed so far otherwise, divided by the number of workers."""
+
+    def __init__(self, names, expected_durations=None, workers=1, stream=None, interval=None):
+        self.total = len(names)
+        self.remaining = set(names)
+        self.expected_durations = expected_durations or {}
+        self.workers = max(1, workers)
+        self.stream = stream or sys.stdout
+        self.is_tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.interval = interval if interval is not None else (1 if self.is_tty else 30)
+        self.counts = dict(done=0, skipped=0, failed=0, cached=0)
+        self.durations = []
+        self.start_time = time.time()
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.tick, daemon=True)
+        self.thread.start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def tick(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                if self.is_tty:
+                    self.redraw()
+                else:
+                    print(self.status_line(), file=self.stream, flush=True)
+
+    def eta(self):
+        if not self.remaining:
+            return 0.0
+        if self.durations:
+            mean = sum(self.durations) / len(self.durations)
+        else:
+            known = [d for d in self.expected_durations.values() if d]
+            if not known:
+                return None
+            mean = sum(known) / len(known)
+        expected = sum(self.expected_durations.get(name, mean) for name in self.remaining)
+        return expected / self.workers
+
+    def status_line(self):
+        elapsed = time.time() - self.start_time
+        finished = self.total - len(self.remaining)
+        processed = self.counts["done"] + self.counts["failed"]
+        rate = processed / (elapsed / 60) if elapsed > 0 else 0.0
+        return (
+            f"[{finished}/{self.total}] done {self.counts['done']} ({self.counts['cached']} cached), "
+            f"skipped {self.counts['skipped']}, "
+            f"failed {self.counts['failed']} | {rate:.1f} datasets/min | "
+            f"elapsed {format_duration(elapsed)}, ETA {format_duration(self.eta())}"
+        )
+
+    def redraw(self):
+        self.stream.write("\r\033[K" + self.status_line())
+        self.stream.flush()
+
+    def log(self, *args):
+        """Print a message, keeping the status line (on a TTY) below it."""
+        with self.lock:
+            if self.is_tty:
+                self.stream.write("\r\033[K")
+            print(*args, file=self.stream, flush=True)
+            if self.is_tty:
+                self.redraw()
+
+    def finish(self, name, status, duration=None, cached=False):
+        """Record the end of a dataset, `status` being one of "done", "skipped" or "failed", `cached` whether its
+        context came from the context cache."""
+        with self.lock:
+            self.counts[status] += 1
+            if cached:
+                self.counts["cached"] += 1
+            self.remaining.discard(name)
+            if duration is not None:
+                self.durations.append(duration)
+            if self.is_tty:
+                self.redraw()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            if self.is_tty:
+                self.stream.write("\r\033[K")
+            print(self.status_line(), file=self.stream, flush=True)
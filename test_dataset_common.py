@@ -14,22 +14,35 @@
 # limitations under the License.
 
 import glob
+import hashlib
+import inspect
+import itertools
 import os
+import re
 import tempfile
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from multiprocessing import Pool
 from unittest import TestCase
 
 from absl.testing import parameterized
 
+import pyarrow as pa
+
 from datasets import (
+    ArrowBasedBuilder,
     BuilderConfig,
+    Dataset,
     DatasetBuilder,
+    DatasetDict,
     DownloadConfig,
     Features,
     GenerateMode,
     MockDownloadManager,
+    Split,
+    SplitDict,
     Value,
     cached_path,
     hf_api,
@@ -49,6 +62,9 @@ logger = logging.get_logger(__name__)
 
 REQUIRE_FAISS = {"wiki_dpr"}
 
+# Extension of the dummy train/test/dev files of the packaged builders
+PACKAGED_BUILDERS = {"Csv": "csv", "Json": "json", "Pandas": "pkl", "Text": "txt"}
+
 
 def skip_if_dataset_requires_faiss(test_case):
     @wraps(test_case)
@@ -81,19 +97,41 @@ def skip_if_not_compatible_with_windows(test_case):
 
 
 class DatasetTester(object):
-    def __init__(self, parent):
+    def __init__(self, parent, packaged_fast_path=False, datasets_dir=None):
         self.parent = parent if parent is not None else TestCase()
+        # Directory of the local datasets (is_local), ./datasets if not given
+        self.datasets_dir = datasets_dir
+        # Build the dummy datasets of the packaged builders in memory, see load_packaged_dataset. Off by default, so
+        # that the tests keep running the real download_and_prepare of the builders
+        self.packaged_fast_path = packaged_fast_path
+        # Builder classes already resolved, by (dataset_name, is_local)
+        self.builder_classes = {}
+        # Number of configs asked to iter_load_dataset, and of dummy datasets it actually planned to build
+        self.configs_requested = 0
+        self.configs_built = 0
 
     def load_builder_class(self, dataset_name, is_local=False):
+        key = (dataset_name, is_local)
+        if key in self.builder_classes:
+            return self.builder_classes[key]
         # Download/copy dataset script
         if is_local is True:
-            module_path, _ = prepare_module("./datasets/" + dataset_name)
+            datasets_dir = self.datasets_dir if self.datasets_dir is not None else "./datasets"
+            module_path, _ = prepare_module(os.path.join(datasets_dir, dataset_name))
         else:
             module_path, _ = prepare_module(dataset_name, download_config=DownloadConfig(force_download=True))
         # Get dataset builder class
         builder_cls = import_main_class(module_path)
+        self.builder_classes[key] = builder_cls
         return builder_cls
 
+    def mock_download_manager(self, dataset_name, config, version, **kwargs):
+        mock_dl_manager = MockDownloadManager(dataset_name=dataset_name, config=config, version=version, **kwargs)
+        if self.datasets_dir is not None:
+            # The local dummy data is read from datasets_scripts_dir/NAME
+            mock_dl_manager.datasets_scripts_dir = str(self.datasets_dir)
+        return mock_dl_manager
+
     def load_all_configs(self, dataset_name, is_local=False):
         # get builder class
         builder_cls = self.load_builder_class(dataset_name, is_local=is_local)
@@ -103,106 +141,262 @@ class DatasetTester(object):
             return [None]
         return builder.BUILDER_CONFIGS
 
-    def check_load_dataset(self, dataset_name, configs, is_local=False):
+    def check_load_dataset(self, dataset_name, configs, is_local=False, num_workers=1):
         ret = {}
-        for config in configs:
-            with tempfile.TemporaryDirectory() as processed_temp_dir, tempfile.TemporaryDirectory() as raw_temp_dir:
+        for name, dataset in self.iter_load_dataset(dataset_name, configs, is_local=is_local, num_workers=num_workers):
+            if dataset is None:
+                return
+            ret[name] = dataset
+        return ret
 
-                # create config and dataset
-                dataset_builder_cls = self.load_builder_class(dataset_name, is_local=is_local)
-                name = config.name if config is not None else None
-                dataset_builder = dataset_builder_cls(name=name, cache_dir=processed_temp_dir)
+    def config_fingerprint(self, dataset_name, config, is_local=False):
+        """Identify the configs that produce the same dummy dataset: same dummy data content, same features, and same
+        builder config kwargs (the config name only counts if the script uses it). Returns None if unknown."""
+        if not is_local:
+            return None
+        builder_cls = self.load_builder_class(dataset_name, is_local=is_local)
+        name = config.name if config is not None else None
+        with tempfile.TemporaryDirectory() as processed_temp_dir:
+            dataset_builder = builder_cls(name=name, cache_dir=processed_temp_dir)
+            features = dataset_builder.info.features if dataset_builder.info is not None else None
+            version = config.version if config is not None else dataset_builder.VERSION
+
+        mock_dl_manager = self.mock_download_manager(dataset_name, config, version, is_local=True)
+        dummy_zip = mock_dl_manager.local_path_to_dummy_data
+        if not os.path.isfile(dummy_zip):
+            return None
+        h = hashlib.sha256()
+        with open(dummy_zip, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+        kwargs = {}
+        if config is not None:
+            ignored = {"name", "description", "version"}
+            try:
+                source = inspect.getsource(inspect.getmodule(builder_cls))
+            except (OSError, TypeError):
+                source = None
+            if source is None or re.search(r"config\.name\b", source):
+                ignored.remove("name")
+            kwargs = {key: repr(value) for key, value in vars(config).items() if key not in ignored}
+        return h.hexdigest(), repr(features), tuple(sorted(kwargs.items()))
+
+    def group_equivalent_configs(self, dataset_name, configs, is_local=False):
+        """Group the configs that produce the same dummy dataset, keeping the order of their first appearance."""
+        groups = {}
+        for index, config in enumerate(configs):
+            fingerprint = self.config_fingerprint(dataset_name, config, is_local=is_local)
+            # Configs without a fingerprint are never merged
+            key = ("unique", index) if fingerprint is None else fingerprint
+            groups.setdefault(key, []).append(config)
+        return list(groups.values())
+
+    def iter_load_dataset(self, dataset_name, configs, is_local=False, num_workers=1, deduplicate=False):
+        """Same as check_load_dataset, but yields the (config name, dataset) pairs one by one, while their temporary
+        directories still exist, so that the caller can process and drop each config before the next one is built.
+        Yields a single (config name, None) pair for datasets that are not tested with dummy data.
+        With num_workers > 1, up to num_workers configs are built concurrently in threads (Arrow writing releases
+        the GIL), and the pairs are still yielded in the order of `configs`.
+        With deduplicate, equivalent configs (see config_fingerprint) are built once: the same dataset is yielded for
+        each of them, one after the other, so the order of `configs` is kept only between groups."""
+        configs = list(configs)
+        if deduplicate:
+            groups = self.group_equivalent_configs(dataset_name, configs, is_local=is_local)
+        else:
+            groups = [[config] for config in configs]
+        self.configs_requested += len(configs)
+        self.configs_built += len(groups)
+
+        if num_workers > 1:
+            yield from self.iter_load_dataset_concurrently(dataset_name, groups, is_local, num_workers)
+            return
 
-                # TODO: skip Beam datasets and datasets that lack dummy data for now
-                if not dataset_builder.test_dummy_data:
-                    logger.info("Skip tests for this dataset for now")
+        for group in groups:
+            with tempfile.TemporaryDirectory() as processed_temp_dir, tempfile.TemporaryDirectory() as raw_temp_dir:
+                dataset = self.load_config_dataset(dataset_name, group[0], processed_temp_dir, raw_temp_dir, is_local)
+                if dataset is None:
+                    yield self.config_name(group[0]), None
                     return
+                for config in group:
+                    yield self.config_name(config), dataset
+                # Do not keep the dataset alive while the next config is built
+                del dataset
 
-                if config is not None:
-                    version = config.version
-                else:
-                    version = dataset_builder.VERSION
-
-                def check_if_url_is_valid(url):
-                    if is_remote_url(url) and "\\" in url:
-                        raise ValueError(f"Bad remote url '{url}'' since it contains a backslash")
-
-                # create mock data loader manager that has a special download_and_extract() method to download dummy data instead of real data
-                mock_dl_manager = MockDownloadManager(
-                    dataset_name=dataset_name,
-                    config=config,
-                    version=version,
-                    cache_dir=raw_temp_dir,
-                    is_local=is_local,
-                    #download_callbacks=[check_if_url_is_valid],
-                )
+    def config_name(self, config):
+        return "default" if config is None else config.name
+
+    def load_config_dataset_in_temp_dirs(self, dataset_name, config, is_local=False):
+        temp_dirs = [tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()]
+        try:
+            dataset = self.load_config_dataset(dataset_name, config, temp_dirs[0].name, temp_dirs[1].name, is_local)
+        except BaseException:
+            for temp_dir in temp_dirs:
+                temp_dir.cleanup()
+            raise
+        return dataset, temp_dirs
+
+    def iter_load_dataset_concurrently(self, dataset_name, groups, is_local, num_workers):
+        # Resolve the builder class once, before the threads use it
+        self.load_builder_class(dataset_name, is_local=is_local)
+
+        groups = iter(groups)
+        # (group, future) pairs, in order: at most num_workers datasets are being built or waiting to be consumed,
+        # which bounds the memory used
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+
+            def submit(count):
+                for group in itertools.islice(groups, count):
+                    future = executor.submit(self.load_config_dataset_in_temp_dirs, dataset_name, group[0], is_local)
+                    pending.append((group, future))
 
-                if dataset_builder.__class__.__name__ == "Csv":
-                    # need slight adoption for csv dataset
-                    mock_dl_manager.download_dummy_data()
-                    path_to_dummy_data = mock_dl_manager.dummy_file
-                    dataset_builder.config.data_files = {
-                        "train": os.path.join(path_to_dummy_data, "train.csv"),
-                        "test": os.path.join(path_to_dummy_data, "test.csv"),
-                        "dev": os.path.join(path_to_dummy_data, "dev.csv"),
-                    }
-                elif dataset_builder.__class__.__name__ == "Json":
-                    # need slight adoption for json dataset
-                    mock_dl_manager.download_dummy_data()
-                    path_to_dummy_data = mock_dl_manager.dummy_file
-                    dataset_builder.config.data_files = {
-                        "train": os.path.join(path_to_dummy_data, "train.json"),
-                        "test": os.path.join(path_to_dummy_data, "test.json"),
-                        "dev": os.path.join(path_to_dummy_data, "dev.json"),
-                    }
-                elif dataset_builder.__class__.__name__ == "Pandas":
-                    # need slight adoption for json dataset
-                    mock_dl_manager.download_dummy_data()
-                    path_to_dummy_data = mock_dl_manager.dummy_file
-                    dataset_builder.config.data_files = {
-                        "train": os.path.join(path_to_dummy_data, "train.pkl"),
-                        "test": os.path.join(path_to_dummy_data, "test.pkl"),
-                        "dev": os.path.join(path_to_dummy_data, "dev.pkl"),
-                    }
-                elif dataset_builder.__class__.__name__ == "Text":
-                    mock_dl_manager.download_dummy_data()
-                    path_to_dummy_data = mock_dl_manager.dummy_file
-                    dataset_builder.config.data_files = {
-                        "train": os.path.join(path_to_dummy_data, "train.txt"),
-                        "test": os.path.join(path_to_dummy_data, "test.txt"),
-                        "dev": os.path.join(path_to_dummy_data, "dev.txt"),
-                    }
-
-                # mock size needed for dummy data instead of actual dataset
-                if dataset_builder.info is not None:
-                    # approximate upper bound of order of magnitude of dummy data files
-                    one_mega_byte = 2 << 19
-                    dataset_builder.info.size_in_bytes = 2 * one_mega_byte
-                    dataset_builder.info.download_size = one_mega_byte
-                    dataset_builder.info.dataset_size = one_mega_byte
-
-                # generate examples from dummy data
-                dataset_builder.download_and_prepare(
-                    dl_manager=mock_dl_manager,
-                    download_mode=GenerateMode.FORCE_REDOWNLOAD,
-                    ignore_verifications=True,
-                    try_from_hf_gcs=False,
-                )
+            try:
+                submit(num_workers)
+                while pending:
+                    group, future = pending.popleft()
+                    dataset, temp_dirs = future.result()
+                    try:
+                        if dataset is None:
+                            yield self.config_name(group[0]), None
+                            return
+                        submit(1)
+                        for config in group:
+                            yield self.config_name(config), dataset
+                        del dataset
+                    finally:
+                        for temp_dir in temp_dirs:
+                            temp_dir.cleanup()
+            finally:
+                # Stopped early (error, or the caller closed the generator): clean up the datasets still in flight
+                for group, future in pending:
+                    if future.cancel():
+                        continue
+                    try:
+                        _, temp_dirs = future.result()
+                    except Exception:
+                        continue
+                    for temp_dir in temp_dirs:
+                        temp_dir.cleanup()
+
+    def load_config_dataset(self, dataset_name, config, processed_temp_dir, raw_temp_dir, is_local=False):
+        # create config and dataset
+        dataset_builder_cls = self.load_builder_class(dataset_name, is_local=is_local)
+        name = config.name if config is not None else None
+        dataset_builder = dataset_builder_cls(name=name, cache_dir=processed_temp_dir)
+
+        # TODO: skip Beam datasets and datasets that lack dummy data for now
+        if not dataset_builder.test_dummy_data:
+            logger.info("Skip tests for this dataset for now")
+            return None
+
+        if config is not None:
+            version = config.version
+        else:
+            version = dataset_builder.VERSION
+
+        def check_if_url_is_valid(url):
+            if is_remote_url(url) and "\\" in url:
+                raise ValueError(f"Bad remote url '{url}'' since it contains a backslash")
+
+        # create mock data loader manager that has a special download_and_extract() method to download dummy data instead of real data
+        mock_dl_manager = self.mock_download_manager(
+            dataset_name,
+            config,
+            version,
+            cache_dir=raw_temp_dir,
+            is_local=is_local,
+            #download_callbacks=[check_if_url_is_valid],
+        )
 
-                # get dataset
-                dataset = dataset_builder.as_dataset(ignore_verifications=True)
+        builder_name = dataset_builder.__class__.__name__
+        if builder_name in PACKAGED_BUILDERS:
+            # need slight adoption for the packaged datasets
+            extension = PACKAGED_BUILDERS[builder_name]
+            path_to_dummy_data = mock_dl_manager.dummy_file
+            dataset_builder.config.data_files = {
+                split: os.path.join(path_to_dummy_data, f"{split}.{extension}") for split in ("train", "test", "dev")
+            }
+            if self.packaged_fast_path and isinstance(dataset_builder, ArrowBasedBuilder):
+                dataset = self.load_packaged_dataset(dataset_builder, mock_dl_manager)
+                if dataset is not None:
+                    self.check_splits(dataset_builder, dataset)
+                    return dataset
+
+        # mock size needed for dummy data instead of actual dataset
+        if dataset_builder.info is not None:
+            # approximate upper bound of order of magnitude of dummy data files
+            one_mega_byte = 2 << 19
+            dataset_builder.info.size_in_bytes = 2 * one_mega_byte
+            dataset_builder.info.download_size = one_mega_byte
+            dataset_builder.info.dataset_size = one_mega_byte
+
+        # generate examples from dummy data
+        dataset_builder.download_and_prepare(
+            dl_manager=mock_dl_manager,
+            download_mode=GenerateMode.FORCE_REDOWNLOAD,
+            ignore_verifications=True,
+            try_from_hf_gcs=False,
+        )
 
-                # check that dataset is not empty
-                self.parent.assertListEqual(sorted(dataset_builder.info.splits.keys()), sorted(dataset))
-                for split in dataset_builder.info.splits.keys():
-                    # check that loaded datset is not empty
-                    self.parent.assertTrue(len(dataset[split]) > 0)
+        # get dataset
+        dataset = dataset_builder.as_dataset(ignore_verifications=True)
+        self.check_splits(dataset_builder, dataset)
+        return dataset
+
+    def check_splits(self, dataset_builder, dataset):
+        # check that dataset is not empty
+        self.parent.assertListEqual(sorted(dataset_builder.info.splits.keys()), sorted(dataset))
+        for split in dataset_builder.info.splits.keys():
+            # check that loaded datset is not empty
+            self.parent.assertTrue(len(dataset[split]) > 0)
+
+    def load_packaged_dataset(self, dataset_builder, dl_manager):
+        """Build the DatasetDict of a packaged builder (Csv, Json, Pandas, Text) in memory. Their _generate_tables
+        already read each file with a single pyarrow call, so the tables are used as they are, instead of being
+        written to Arrow files and memory mapped back by download_and_prepare and as_dataset.
+        Splits, features and errors are the same as with download_and_prepare: the features are inferred from the
+        schema of the first table of a split (like ArrowWriter does), and those of the last split are kept.
+        Returns None when a split yields no table: the generic path then reports it."""
+        split_dict = SplitDict(dataset_name=dataset_builder.name)
+        tables = {}
+        for split_generator in dataset_builder._split_generators(dl_manager):
+            split_info = split_generator.split_info
+            if str(split_info.name).lower() == "all":
+                return None
+            split_dict.add(split_info)
+            try:
+                split_tables = [table for _, table in dataset_builder._generate_tables(**split_generator.gen_kwargs)]
+            except OSError as e:
+                raise OSError(
+                    "Cannot find data file. "
+                    + (dataset_builder.manual_download_instructions or "")
+                    + "\nOriginal error:\n"
+                    + str(e)
+                )
+            if len(split_tables) == 0:
+                return None
+            schema = split_tables[0].schema
+            table = pa.concat_tables([split_table.cast(schema) for split_table in split_tables])
+            split_info.num_examples = table.num_rows
+            split_info.num_bytes = table.nbytes
+            dataset_builder.info.features = Features.from_arrow_schema(schema)
+            tables[split_info.name] = table
+
+        dataset_builder.info.splits = split_dict
+        return DatasetDict(
+            {
+                # A fingerprint of its own: the default one would hash the whole in-memory table
+                split: Dataset(
+                    table,
+                    info=dataset_builder.info,
+                    split=Split(split),
+                    fingerprint=hashlib.sha256(f"{dataset_builder.cache_dir}/{split}".encode()).hexdigest(),
+                )
+                for split, table in tables.items()
+            }
+        )
 
-                if config is None:
-                    ret["default"] = dataset
-                else:
-                    ret[config.name] = dataset
-        return ret
 
 def get_local_dataset_names():
     datasets = [dataset_dir.split(os.sep)[-2] for dataset_dir in glob.glob("./datasets/*/")]
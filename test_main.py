@@ -0,0 +1,1447 @@
+import gc
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+import weakref
+import zipfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import datasets
+
+from main import DatasetREADMESingleWriter, DatasetREADMEWriter, generate_cards
+
+
+# test_dataset_common lists the remote datasets when it is imported: keep these tests offline
+_remote_datasets_patch = patch.object(datasets.hf_api.HfApi, "dataset_list", lambda self, **kwargs: ["dummy"])
+
+
+def setUpModule():
+    _remote_datasets_patch.start()
+
+
+def tearDownModule():
+    _remote_datasets_patch.stop()
+
+
+def offline_worker():
+    """worker_initializer keeping the worker processes offline too: they are spawned, so they are not patched."""
+    _remote_datasets_patch.start()
+
+
+SYNTHETIC_SCRIPT = """
+import csv
+import os
+
+import datasets
+
+
+class SyntheticConfig(datasets.BuilderConfig):
+    def __init__(self, **kwargs):
+        super().__init__(version=datasets.Version("1.0.0"), **kwargs)
+
+
+class Synthetic(datasets.GeneratorBasedBuilder):
+    BUILDER_CONFIGS = [SyntheticConfig(name=name) for name in {config_names!r}]
+
+    def _info(self):
+        return datasets.DatasetInfo(
+            description="A synthetic dataset.",
+            features=datasets.Features({{"id": datasets.Value("string"), "text": datasets.Value("string")}}),
+            homepage="https://example.com",
+            citation="@synthetic",
+        )
+
+    def _split_generators(self, dl_manager):
+        path = dl_manager.download_and_extract("https://example.com/data.zip")
+        return [
+            datasets.SplitGenerator(name=split, gen_kwargs={{"path": os.path.join(path, split + ".csv")}})
+            for split in ("train", "validation", "test")
+        ]
+
+    def _generate_examples(self, path):
+        with open(path, encoding="utf-8") as f:
+            for i, row in enumerate(csv.reader(f)):
+                yield i, {{"id": str(i), "text": row[0]}}
+"""
+
+
+def create_synthetic_dataset(root, name, config_names, rows=20, shared_dummy_data=False):
+    """Create a dataset script, its dataset_infos.json and its dummy data in `root`/datasets/`name`.
+    With `shared_dummy_data`, all the configs have the same dummy data."""
+    path = Path(root) / "datasets" / name
+    path.mkdir(parents=True)
+    (path / f"{name}.py").write_text(SYNTHETIC_SCRIPT.format(config_names=list(config_names)))
+
+    infos = {}
+    for config_name in config_names:
+        splits = {}
+        zip_path = path / "dummy" / config_name / "1.0.0" / "dummy_data.zip"
+        zip_path.parent.mkdir(parents=True)
+        with zipfile.ZipFile(zip_path, "w") as zip_file:
+            for split in ("train", "validation", "test"):
+                prefix = name if shared_dummy_data else config_name
+                lines = [f"{prefix} {split} example {i}\n" for i in range(rows)]
+                zip_file.writestr(f"dummy_data/data.zip/{split}.csv", "".join(lines))
+                splits[split] = {"name": split, "num_bytes": 1000, "num_examples": rows, "dataset_name": name}
+        infos[config_name] = {
+            "description": "A synthetic dataset.",
+            "citation": "@synthetic",
+            "homepage": "https://example.com",
+            "license": "",
+            "features": {
+                "id": {"dtype": "string", "id": None, "_type": "Value"},
+                "text": {"dtype": "string", "id": None, "_type": "Value"},
+            },
+            "config_name": config_name,
+            "version": {"version_str": "1.0.0", "major": 1, "minor": 0, "patch": 0},
+            "splits": splits,
+            "download_size": 1000,
+            "dataset_size": 3000,
+            "size_in_bytes": 4000,
+        }
+    (path / "dataset_infos.json").write_text(json.dumps(infos))
+    return path
+
+
+# Packaged builders like those of the datasets repository (csv, json, pandas, text), with dummy train/test/dev files
+PACKAGED_SCRIPT = """
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pac
+import pyarrow.json as paj
+
+import datasets
+
+
+class {builder_name}(datasets.ArrowBasedBuilder):
+    def _info(self):
+        return datasets.DatasetInfo()
+
+    def _split_generators(self, dl_manager):
+        data_files = dl_manager.download_and_extract(self.config.data_files)
+        return [
+            datasets.SplitGenerator(name=split, gen_kwargs={{"files": [files]}}) for split, files in data_files.items()
+        ]
+
+    def _generate_tables(self, files):
+        for i, file in enumerate(files):
+            yield i, self._read_table(file)
+
+    def _read_table(self, file):
+        builder_name = "{builder_name}"
+        if builder_name == "Csv":
+            return pac.read_csv(file)
+        if builder_name == "Json":
+            return paj.read_json(file)
+        if builder_name == "Pandas":
+            return pa.Table.from_pandas(pd.read_pickle(file))
+        return pac.read_csv(
+            file,
+            read_options=pac.ReadOptions(column_names=["text"]),
+            parse_options=pac.ParseOptions(delimiter="\\b", quote_char=False, escape_char=False),
+        )
+"""
+
+
+def create_packaged_dataset(root, builder_name, rows=20):
+    """Create a packaged builder dataset (builder_name is Csv, Json, Pandas or Text) and its dummy data in
+    `root`/datasets/`name`, where name is builder_name in lower case."""
+    import pandas as pd
+
+    name = builder_name.lower()
+    path = Path(root) / "datasets" / name
+    path.mkdir(parents=True)
+    (path / f"{name}.py").write_text(PACKAGED_SCRIPT.format(builder_name=builder_name))
+
+    zip_path = path / "dummy" / "0.0.0" / "dummy_data.zip"
+    zip_path.parent.mkdir(parents=True)
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        for split in ("train", "test", "dev"):
+            rows_data = [dict(id=i, text=f"{split} example {i}", score=i / 4) for i in range(rows)]
+            if builder_name == "Csv":
+                content = "id,text,score\n" + "".join(f"{r['id']},{r['text']},{r['score']}\n" for r in rows_data)
+            elif builder_name == "Json":
+                content = "".join(json.dumps(r) + "\n" for r in rows_data)
+            elif builder_name == "Pandas":
+                pickle_path = Path(root) / f"{split}.pkl"
+                pd.DataFrame(rows_data).to_pickle(pickle_path)
+                content = pickle_path.read_bytes()
+            else:
+                content = "".join(r["text"] + "\n" for r in rows_data)
+            extension = dict(Csv="csv", Json="json", Pandas="pkl", Text="txt")[builder_name]
+            zip_file.writestr(f"dummy_data/{split}.{extension}", content)
+    return path
+
+
+class SyntheticDatasetTestCase(TestCase):
+    def setUp(self):
+        # The dummy data loader uses paths relative to the current directory
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+
+class StreamingConfigsTest(SyntheticDatasetTestCase):
+    def test_one_config_in_memory_at_a_time(self):
+        import test_dataset_common as common
+
+        config_names = [f"config_{i:02d}" for i in range(50)]
+        path = create_synthetic_dataset(self.tmp_dir.name, "synthetic", config_names)
+
+        iter_load_dataset = common.DatasetTester.iter_load_dataset
+        references = []
+        max_alive = []
+
+        def tracking_iter_load_dataset(tester, *args, **kwargs):
+            for name, dataset in iter_load_dataset(tester, *args, **kwargs):
+                # The next config is built: none of the previous ones may still be alive
+                gc.collect()
+                max_alive.append(sum(reference() is not None for reference in references))
+                references.append(weakref.ref(dataset))
+                yield name, dataset
+                del dataset
+
+        with patch.object(common.DatasetTester, "iter_load_dataset", tracking_iter_load_dataset):
+            writer = DatasetREADMESingleWriter(path, "synthetic", max_configs=len(config_names))
+            context = writer.gather_context()
+
+        self.assertEqual(len(references), len(config_names))
+        self.assertEqual(max(max_alive), 0)
+        self.assertEqual(writer.warnings, [])
+        for config_name in config_names:
+            self.assertIn(config_name, context["configs"][config_name]["excerpt"])
+
+    def test_concurrent_configs_same_context(self):
+        import test_dataset_common as common
+
+        config_names = [f"config_{i:02d}" for i in range(10)]
+        path = create_synthetic_dataset(self.tmp_dir.name, "synthetic", config_names)
+
+        serial = DatasetREADMESingleWriter(path, "synthetic", max_configs=10).gather_context()
+        concurrent = DatasetREADMESingleWriter(path, "synthetic", max_configs=10, config_workers=4).gather_context()
+        self.assertEqual(serial, concurrent)
+
+        tester = common.DatasetTester(None)
+        configs = tester.load_all_configs("synthetic", is_local=True)
+        loaded = tester.check_load_dataset("synthetic", configs, is_local=True, num_workers=4)
+        self.assertEqual(list(loaded), config_names)
+
+
+class OutputEquivalenceTest(SyntheticDatasetTestCase):
+    """The speedup modes must produce the same cards and logs as a plain serial run without the cache: worker
+    processes, concurrent configs, no config deduplication, no prefetch/write pipeline or short queues, the context
+    cache and run journal (serial and with workers), and re-rendering the cached contexts. Bundles and the
+    generate_cards API must match the tree written by the command line."""
+
+    def setUp(self):
+        super().setUp()
+        root = Path(self.tmp_dir.name)
+        create_synthetic_dataset(root, "multi", ["alpha", "beta", "gamma"])
+        create_synthetic_dataset(root, "single", ["default"], rows=5)
+        # Configs sharing the same dummy data
+        create_synthetic_dataset(root, "same", ["one", "two"], shared_dummy_data=True)
+        # Warnings: a config without dummy data, no dummy data at all
+        path = create_synthetic_dataset(root, "partial", ["complete", "incomplete"])
+        (path / "dummy" / "incomplete" / "1.0.0" / "dummy_data.zip").unlink()
+        path = create_synthetic_dataset(root, "nodummy", ["default"])
+        for zip_path in (path / "dummy").glob("**/dummy_data.zip"):
+            zip_path.unlink()
+        # An error: no dataset_infos.json
+        path = create_synthetic_dataset(root, "noinfos", ["default"])
+        (path / "dataset_infos.json").unlink()
+        # Not a dataset
+        (root / "datasets" / "notes").mkdir()
+
+        self.datasets_path_patch = patch.object(
+            DatasetREADMEWriter, "datasets_path", lambda writer: (root / "datasets").resolve()
+        )
+        self.datasets_path_patch.start()
+
+    def tearDown(self):
+        self.datasets_path_patch.stop()
+        super().tearDown()
+
+    def run_generator(self, rerender_only=False, **kwargs):
+        """Run the generator from scratch (no README yet), and return its outputs: {path: content} of the READMEs
+        and of the logs."""
+        root = Path(self.tmp_dir.name)
+        for readme in (root / "datasets").glob("*/README.md"):
+            readme.unlink()
+        for log in root.glob("*.log"):
+            log.unlink()
+
+        writer = DatasetREADMEWriter(worker_initializer=offline_worker, **kwargs)
+        try:
+            writer.run(rerender_only=rerender_only)
+        finally:
+            writer.close()
+
+        outputs = {}
+        for path in sorted((root / "datasets").glob("*/README.md")) + sorted(root.glob("*.log")):
+            outputs[str(path.relative_to(root))] = path.read_bytes()
+        return writer, outputs
+
+    def test_speedup_modes_same_output(self):
+        root = Path(self.tmp_dir.name)
+        writer, reference = self.run_generator(cache_dir=root / "reference_cache", use_cache=False)
+        self.assertEqual(
+            sorted(reference),
+            [
+                "datasets/multi/README.md",
+                "datasets/nodummy/README.md",
+                "datasets/partial/README.md",
+                "datasets/same/README.md",
+                "datasets/single/README.md",
+                "error.log",
+                "warning.log",
+            ],
+        )
+        self.assertIn(b"noinfos:", reference["error.log"])
+        self.assertIn(b"nodummy:", reference["warning.log"])
+        self.assertIn(b"partial:", reference["warning.log"])
+        # The configs of "same" are built once
+        self.assertEqual((writer.configs_requested, writer.configs_built), (8, 7))
+
+        modes = dict(
+            parallel=dict(workers=3),
+            concurrent_configs=dict(config_workers=3),
+            no_config_dedup=dict(deduplicate_configs=False),
+            no_pipeline=dict(prefetch=0, write_queue=0),
+            parallel_short_queues=dict(workers=2, prefetch=1, write_queue=1),
+        )
+        for mode, kwargs in modes.items():
+            with self.subTest(mode=mode):
+                writer, outputs = self.run_generator(cache_dir=root / f"{mode}_cache", use_cache=False, **kwargs)
+                self.assertEqual(outputs, reference)
+                if kwargs.get("workers", 1) > 1:
+                    # Reported by the workers, which are still alive for rusage
+                    self.assertGreater(writer.metrics.worker_peak_rss, 0)
+
+        cache_dir = root / "cache"
+        _, outputs = self.run_generator(cache_dir=cache_dir)
+        self.assertEqual(outputs, reference)
+
+        with self.subTest(mode="cached"):
+            writer, outputs = self.run_generator(cache_dir=cache_dir)
+            self.assertEqual(outputs, reference)
+            # Every context came from the cache, and every failure from the journal
+            self.assertEqual(writer.metrics.cache_accesses["context"], [5, 0])
+            self.assertEqual(writer.metrics.cache_accesses["failures"], [1, 5])
+            self.assertEqual(writer.configs_built, 0)
+
+        with self.subTest(mode="parallel_cached"):
+            _, outputs = self.run_generator(cache_dir=cache_dir, workers=3)
+            self.assertEqual(outputs, reference)
+
+        with self.subTest(mode="rerender"):
+            _, outputs = self.run_generator(cache_dir=cache_dir, rerender_only=True)
+            self.assertEqual(outputs, reference)
+
+    def test_errors_logged_with_dataset_name(self):
+        root = Path(self.tmp_dir.name)
+        with patch.object(DatasetREADMEWriter, "log", autospec=True) as log:
+            self.run_generator(cache_dir=root / "cache", use_cache=False)
+        errors = [call.args[1:] for call in log.call_args_list if call.args[1] == "ERROR"]
+        self.assertEqual([error[1] for error in errors], ["noinfos"])
+
+    def test_worker_pool_kept_between_runs(self):
+        from discovery import discover_datasets
+
+        root = Path(self.tmp_dir.name)
+        writer = DatasetREADMEWriter(
+            cache_dir=root / "cache", use_cache=False, workers=2, worker_initializer=offline_worker
+        )
+        dest_path = writer.datasets_path()
+        entries = discover_datasets(dest_path, names=["single", "multi"])
+        try:
+            writer.run_entries(dest_path, entries, force=True, explicit=True)
+            executor = writer.executor
+            self.assertIsNotNone(executor)
+            # Like a --watch batch: the same worker processes handle it
+            writer.run_entries(dest_path, entries[:1], force=True, explicit=True)
+            self.assertIs(writer.executor, executor)
+        finally:
+            writer.close()
+        self.assertIsNone(writer.executor)
+        self.assertIn("# Dataset Card", (root / "datasets" / "single" / "README.md").read_text())
+
+    def test_bundle(self):
+        from bundle import read_bundle, unpack_bundle
+
+        root = Path(self.tmp_dir.name)
+        _, reference = self.run_generator(cache_dir=root / "cache")
+        for bundle_name in ["cards.jsonl", "cards.jsonl.gz"]:
+            with self.subTest(bundle=bundle_name):
+                bundle = root / bundle_name
+                _, outputs = self.run_generator(cache_dir=root / "cache", bundle=bundle)
+                # Only the logs are written
+                self.assertEqual(outputs, {name: reference[name] for name in ["error.log", "warning.log"]})
+                self.assertEqual(sorted(read_bundle(bundle)), ["multi", "nodummy", "partial", "same", "single"])
+
+                self.assertEqual(unpack_bundle(bundle, root / "datasets"), (5, 0))
+                for name, content in reference.items():
+                    self.assertEqual((root / name).read_bytes(), content)
+                self.assertEqual(unpack_bundle(bundle, root / "datasets"), (0, 5))
+
+        # A partial run updates the bundle
+        DatasetREADMEWriter(cache_dir=root / "cache", bundle=bundle).run(to_run=["single"])
+        self.assertEqual(len(read_bundle(bundle)), 5)
+
+        # The cards to skip are those already in the bundle, whatever READMEs the datasets tree has
+        other_bundle = root / "other.jsonl"
+        other_bundle.write_text("")
+        writer = DatasetREADMEWriter(cache_dir=root / "cache", bundle=other_bundle)
+        writer.run()
+        self.assertEqual(read_bundle(other_bundle), read_bundle(bundle))
+        self.assertEqual((writer.written, writer.unchanged), (5, 0))
+        (root / "datasets" / "single" / "README.md").unlink()
+        writer = DatasetREADMEWriter(cache_dir=root / "cache", bundle=other_bundle)
+        writer.run()
+        self.assertEqual((writer.written, writer.unchanged), (0, 0))
+        self.assertEqual(read_bundle(other_bundle), read_bundle(bundle))
+
+        # Corrupted cards are detected
+        content = bundle.with_suffix("")
+        content.write_text(gzip.decompress(bundle.read_bytes()).decode("utf-8").replace("synthetic", "Synthetic"))
+        with self.assertRaises(ValueError):
+            read_bundle(content)
+
+    def test_generate_cards(self):
+        root = Path(self.tmp_dir.name)
+        _, reference = self.run_generator(cache_dir=root / "reference_cache", use_cache=False)
+        for readme in (root / "datasets").glob("*/README.md"):
+            readme.unlink()
+        for log in root.glob("*.log"):
+            log.unlink()
+
+        paths = [root / "datasets" / name for name in ["multi", "noinfos", "notes", "partial", "single"]]
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                cards = generate_cards(
+                    paths, cache_dir=root / f"api_cache_{workers}", workers=workers, worker_initializer=offline_worker
+                )
+                cards = {card.name: card for card in cards}
+                self.assertEqual(sorted(cards), ["multi", "noinfos", "notes", "partial", "single"])
+                for name in ["multi", "partial", "single"]:
+                    self.assertEqual(cards[name].markdown.encode(), reference[f"datasets/{name}/README.md"])
+                    self.assertIsNone(cards[name].error)
+                    self.assertIn("render", cards[name].timings)
+                self.assertIsNotNone(cards["partial"].warnings)
+                self.assertIsNone(cards["noinfos"].markdown)
+                self.assertIn(b"noinfos:" + cards["noinfos"].error.encode(), reference["error.log"])
+                self.assertIsNotNone(cards["notes"].error)
+                # Nothing is written but the caches
+                self.assertEqual(list((root / "datasets").glob("*/README.md")) + list(root.glob("*.log")), [])
+
+        with self.assertRaises(ValueError):
+            list(generate_cards([root]))
+
+        # From any directory, with dataset names relative to datasets_root
+        elsewhere = root / "elsewhere"
+        elsewhere.mkdir()
+        os.chdir(elsewhere)
+        for workers in [1, 2]:
+            with self.subTest(workers=workers, datasets_root=True):
+                cards = generate_cards(
+                    ["multi", root / "datasets" / "single"],
+                    datasets_root=root / "datasets",
+                    cache_dir=root / f"root_cache_{workers}",
+                    workers=workers,
+                    worker_initializer=offline_worker,
+                )
+                for card in cards:
+                    self.assertEqual(card.markdown.encode(), reference[f"datasets/{card.name}/README.md"])
+        self.assertEqual(os.listdir(elsewhere), [])
+
+
+class ContextCacheTest(SyntheticDatasetTestCase):
+    def test_transient_dummy_data_errors_not_cached(self):
+        from cache import ContextCache
+
+        root = Path(self.tmp_dir.name)
+        path = create_synthetic_dataset(root, "single", ["default"], rows=5)
+        cache = ContextCache(root / "cache")
+
+        def failing_iter_dummy_datasets(writer, config_names):
+            raise error
+            yield
+
+        # A download error may not happen again: the card gets the warning, the cache nothing
+        error = ConnectionError("Couldn't reach https://example.com/data.zip")
+        with patch.object(DatasetREADMESingleWriter, "iter_dummy_datasets", failing_iter_dummy_datasets):
+            (card,) = generate_cards([path], cache_dir=root / "cache")
+        self.assertIn("Couldn't reach", card.warnings)
+        self.assertIsNone(cache.load("single"))
+
+        (card,) = generate_cards([path], cache_dir=root / "cache")
+        self.assertIsNone(card.warnings)
+        self.assertIsNotNone(cache.load("single"))
+
+        # Missing dummy data fails the same way as long as the dataset files are unchanged: the context is cached
+        cache.entry_file("single").unlink()
+        error = FileNotFoundError("Local file datasets/single/dummy/default/1.0.0/dummy_data.zip doesn't exist")
+        with patch.object(DatasetREADMESingleWriter, "iter_dummy_datasets", failing_iter_dummy_datasets):
+            (card,) = generate_cards([path], cache_dir=root / "cache")
+        self.assertIn("doesn't exist", card.warnings)
+        self.assertEqual(cache.load("single")["warnings"], card.warnings)
+
+        # So do the other deterministic failures, unlike the network ones of requests, timeouts and memory errors
+        import requests
+
+        for error, cached in [
+            (AssertionError("Split train has 3 examples instead of 5"), True),
+            (KeyError("text"), True),
+            (ValueError("Unknown split"), True),
+            (requests.exceptions.ConnectionError("Connection refused"), False),
+            (requests.exceptions.ReadTimeout("Read timed out"), False),
+            (TimeoutError("timed out"), False),
+            (MemoryError(), False),
+        ]:
+            with self.subTest(error=type(error).__name__):
+                cache.entry_file("single").unlink(missing_ok=True)
+                with patch.object(DatasetREADMESingleWriter, "iter_dummy_datasets", failing_iter_dummy_datasets):
+                    (card,) = generate_cards([path], cache_dir=root / "cache")
+                self.assertIsNotNone(card.markdown)
+                self.assertEqual(cache.load("single") is not None, cached)
+
+    def test_failures_keyed_by_inputs_and_generator(self):
+        import main
+
+        root = Path(self.tmp_dir.name)
+        path = create_synthetic_dataset(root, "noinfos", ["default"])
+        (path / "dataset_infos.json").unlink()
+
+        def processed():
+            with patch.object(main, "precheck", wraps=main.precheck) as precheck:
+                (card,) = generate_cards([path], cache_dir=root / "cache")
+            self.assertIn("dataset_infos.json", card.error)
+            return precheck.called
+
+        self.assertTrue(processed())
+        # Same inputs and generator: the failure is taken from the journal
+        self.assertFalse(processed())
+        # Another version of the datasets library may not fail the same way
+        with patch("cache.datasets_version", lambda: "0.0.0"):
+            self.assertTrue(processed())
+            self.assertFalse(processed())
+        (path / "noinfos.py").write_text((path / "noinfos.py").read_text() + "\n")
+        self.assertTrue(processed())
+
+
+class PackagedFastPathTest(SyntheticDatasetTestCase):
+    def test_same_datasets_as_generic_path(self):
+        import test_dataset_common as common
+
+        for builder_name in ["Csv", "Json", "Pandas", "Text"]:
+            with self.subTest(builder=builder_name):
+                create_packaged_dataset(self.tmp_dir.name, builder_name)
+                name = builder_name.lower()
+                loaded = {}
+                for fast_path in [False, True]:
+                    tester = common.DatasetTester(None, packaged_fast_path=fast_path)
+                    configs = tester.load_all_configs(name, is_local=True)
+                    loaded[fast_path] = tester.check_load_dataset(name, configs, is_local=True)["default"]
+
+                generic, fast = loaded[False], loaded[True]
+                self.assertEqual(sorted(fast), ["dev", "test", "train"])
+                self.assertEqual(list(fast), list(generic))
+                for split in generic:
+                    # Built in memory, without Arrow files
+                    self.assertEqual(fast[split]._data_files, [])
+                    self.assertNotEqual(generic[split]._data_files, [])
+                    self.assertEqual(fast[split].features, generic[split].features)
+                    self.assertEqual(fast[split][:], generic[split][:])
+                    self.assertEqual(list(fast[split]), list(generic[split]))
+
+    def test_opt_in(self):
+        import test_dataset_common as common
+
+        create_packaged_dataset(self.tmp_dir.name, "Csv")
+        # The shared test harness keeps running the real builders, the card generator opts in
+        tester = common.DatasetTester(None)
+        configs = tester.load_all_configs("csv", is_local=True)
+        self.assertNotEqual(tester.check_load_dataset("csv", configs, is_local=True)["default"]["train"]._data_files, [])
+
+        writer = DatasetREADMESingleWriter(Path(self.tmp_dir.name) / "datasets" / "csv", "csv")
+        for name, dataset in writer.iter_dummy_datasets(["default"]):
+            self.assertEqual(dataset["train"]._data_files, [])
+
+
+class BackConfigNamesTest(SyntheticDatasetTestCase):
+    def test_discover_config_names(self):
+        import importlib.util
+
+        # back/ is a script directory, not a package
+        spec = importlib.util.spec_from_file_location(
+            "generate_dataset_card", Path(self.cwd) / "back" / "generate_dataset_card.py"
+        )
+        back = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(back)
+
+        config_names = ["gamma", "alpha", "beta"]
+        path = create_synthetic_dataset(self.tmp_dir.name, "synthetic", config_names)
+        writer = back.DataSetCardWriter(str(path), None, None)
+        # In the order of BUILDER_CONFIGS, without loading any dataset
+        with patch.object(back, "load_dataset", side_effect=AssertionError("loaded")):
+            self.assertEqual(writer.discover_config_names(), config_names)
+
+        path = create_synthetic_dataset(self.tmp_dir.name, "noconfigs", [])
+        self.assertEqual(back.DataSetCardWriter(str(path), None, None).discover_config_names(), ["default"])
+
+
+CODEXGLUE_DEFINITIONS = """
+DEFINITIONS = {
+    "default": {
+        "name": "synthetic",
+        "project_url": "https://github.com/madlag/CodeXGLUE/tree/main/Synthetic",
+    }
+}
+"""
+
+
+class CodeXGlueProviderTest(SyntheticDatasetTestCase):
+    def test_codexglue_card_parts(self):
+        path = create_synthetic_dataset(self.tmp_dir.name, "code_x_glue_synthetic", ["go", "java"])
+        script_path = path / "code_x_glue_synthetic.py"
+        script = script_path.read_text()
+        script = script.replace(
+            '{"id": datasets.Value("string"), "text": datasets.Value("string")}',
+            '{\n"id": datasets.Value("string"),  # Index of the sample\n"text": datasets.Value("string"),  # The code\n}',
+        )
+        script_path.write_text(script)
+        (path / "generated_definitions.py").write_text(CODEXGLUE_DEFINITIONS)
+
+        cache_dir = Path(self.tmp_dir.name) / "cache"
+        writer = DatasetREADMESingleWriter(path, "code_x_glue_synthetic", cache_dir=cache_dir)
+        context = writer.gather_context()
+        # The fields are cached in the given cache directory
+        self.assertEqual(len(os.listdir(cache_dir / "fields")), 1)
+
+        self.assertEqual(writer.warnings, [])
+        self.assertEqual(context["header"], {"Homepage": "https://github.com/microsoft/CodeXGLUE/tree/main/Synthetic"})
+        description = context["toc"]["Dataset Description"]
+        self.assertEqual(description["Languages"], "go, java")
+        self.assertEqual(description["Dataset Summary"], "A synthetic dataset.")
+        fields = context["toc"]["Dataset Structure"]["Data Fields"]
+        self.assertIn("#### go, java", fields)
+        self.assertIn("|id        |string| Index of the sample|", fields)
+        self.assertIn("|text      |string| The code           |", fields)
+        self.assertIn("go", context["configs"]["go"]["excerpt"])
+
+
+def tokenize_fields(source):
+    """The field extraction of the CodeXGlue scripts as it was done with tokenize, before extract_fields."""
+    import io
+    import re
+    import tokenize
+
+    was_class = False
+    classes = {}
+    for toktype, tok, start, end, line in tokenize.generate_tokens(io.StringIO(source).readline):
+        if was_class:
+            current_class = tok
+            was_class = False
+        if tok == "class":
+            was_class = True
+        if toktype == tokenize.COMMENT and "datasets." in line:
+            line = line.strip().split("#", 1)
+            field_info = line[0].split(":", 1)
+            search1 = re.search("['\"](.*)['\"]", field_info[0], re.IGNORECASE)
+            type = field_info[1].strip()
+            for replacement in [
+                ("datasets.features.Sequence(", "Sequence["),
+                ('datasets.Value("string")', "string"),
+                ('datasets.Value("int32")', "int32"),
+                ('datasets.Value("bool")', "bool"),
+                (")", "]"),
+                (",", ""),
+            ]:
+                type = type.replace(*replacement)
+            try:
+                classes.setdefault(current_class, {})[search1.group(1)] = dict(type=type, comment=line[1])
+            except Exception:
+                pass
+    return classes
+
+
+CODEXGLUE_FIELDS_SCRIPT = '''
+import datasets
+
+# The features below are commented
+URL = "https://example.com/#datasets.Value"
+
+
+class CodeXGlueBase(datasets.GeneratorBasedBuilder):
+    def _info(self):
+        features = datasets.Features(
+            {
+                "id": datasets.Value("int32"),  # Index of the sample
+                "code": datasets.Value("string"),  # The code, with a # in the comment
+                "label": datasets.Value("bool"),
+            }
+        )
+        return datasets.DatasetInfo(description="# not a comment, datasets.Value")
+
+
+class CodeXGlueCodeCompletion(CodeXGlueBase):
+    def _info(self):
+        features = {
+            "tokens": datasets.features.Sequence(datasets.Value("string")),  # The code tokens
+            'docstring': datasets.Value("string"),  # The "docstring"
+            "url": "#datasets.Value",  # The URL of the sample
+        }
+        return features
+'''
+
+
+class CodeXGlueFieldsTest(TestCase):
+    def test_same_fields_as_tokenize(self):
+        from codexglue import extract_fields
+
+        fields = extract_fields(CODEXGLUE_FIELDS_SCRIPT)
+        self.assertEqual(fields, tokenize_fields(CODEXGLUE_FIELDS_SCRIPT))
+        self.assertEqual(list(fields), ["CodeXGlueBase", "CodeXGlueCodeCompletion"])
+        self.assertEqual(
+            fields["CodeXGlueCodeCompletion"]["tokens"], dict(type="Sequence[string]", comment=" The code tokens")
+        )
+
+    def test_cache_files(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        from codexglue import FieldExtractor, extract_fields
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            script_paths = []
+            for i in range(4):
+                script_paths.append(Path(tmp_dir) / f"script_{i}.py")
+                script_paths[-1].write_text(CODEXGLUE_FIELDS_SCRIPT + f"# variant {i}\n")
+            cache_dir = Path(tmp_dir) / "fields"
+            with patch.object(FieldExtractor, "CACHE_DIR", cache_dir):
+                fields = FieldExtractor(script_paths[0]).run()
+                self.assertEqual(fields, extract_fields(CODEXGLUE_FIELDS_SCRIPT))
+                self.assertEqual(os.listdir(cache_dir), [FieldExtractor.cache_file(script_paths[0]).name])
+
+                # Worker processes extracting fields at the same time keep the entries of each other
+                with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("fork")) as executor:
+                    extracted = list(executor.map(FieldExtractor.run, map(FieldExtractor, script_paths)))
+                self.assertEqual(extracted, [fields] * 4)
+                self.assertEqual(len(os.listdir(cache_dir)), 4)
+                cached = [FieldExtractor.load(FieldExtractor.cache_file(path)) for path in script_paths]
+                self.assertEqual(cached, extracted)
+
+                # The entries of another extractor version are parsed again
+                with patch.object(FieldExtractor, "VERSION", FieldExtractor.VERSION + 1):
+                    self.assertIsNone(FieldExtractor.load(FieldExtractor.cache_file(script_paths[0])))
+                    extracted = FieldExtractor.run_all(script_paths[:2], workers=1)
+                    self.assertEqual(extracted, dict.fromkeys(script_paths[:2], fields))
+                self.assertEqual(len(os.listdir(cache_dir)), 6)
+
+
+class PreviewServerTest(SyntheticDatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        import threading
+
+        from preview import make_server
+
+        root = Path(self.tmp_dir.name)
+        create_synthetic_dataset(root, "single", ["default"], rows=5)
+        create_synthetic_dataset(root, "other", ["default"], rows=5)
+        self.server = make_server(port=0, root=root / "datasets", cache_dir=root / "cache")
+        self.server.RequestHandlerClass.log_message = lambda *args: None
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        del self.server.RequestHandlerClass.log_message
+        super().tearDown()
+
+    def get(self, path):
+        import urllib.error
+        import urllib.request
+
+        url = f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+        try:
+            with urllib.request.urlopen(url) as response:
+                return response.status, response.headers, response.read().decode("utf-8")
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read().decode("utf-8")
+
+    def test_cards_and_context_lru(self):
+        root = Path(self.tmp_dir.name)
+        (card,) = generate_cards([root / "datasets" / "single"], cache_dir=root / "api_cache")
+
+        status, headers, body = self.get("/card/single")
+        self.assertEqual((status, headers["X-Cache"]), (200, "miss"))
+        self.assertEqual(body, card.markdown)
+        self.assertIn("dummy_data;dur=", headers["Server-Timing"])
+
+        status, headers, body = self.get("/card/single")
+        self.assertEqual((status, headers["X-Cache"]), (200, "hit"))
+        self.assertEqual(body, card.markdown)
+
+        # Changing a file of the dataset invalidates its context
+        infos_path = root / "datasets" / "single" / "dataset_infos.json"
+        infos = json.loads(infos_path.read_text())
+        infos["default"]["description"] = "An updated description."
+        infos_path.write_text(json.dumps(infos))
+        status, headers, body = self.get("/card/single")
+        self.assertEqual((status, headers["X-Cache"]), (200, "miss"))
+        self.assertIn("An updated description.", body)
+
+        self.assertEqual(self.get("/card/missing")[0], 404)
+        self.assertEqual(self.get("/card/..%2Fcache")[0], 404)
+
+        # The least recently used context is dropped when the LRU is full
+        previewer = self.server.previewer
+        previewer.contexts.max_bytes = previewer.contexts.size
+        self.assertEqual(self.get("/card/other")[1]["X-Cache"], "miss")
+        self.assertEqual(list(previewer.contexts.entries), ["other"])
+
+        stats = json.loads(self.get("/stats")[2])
+        self.assertEqual((stats["requests"], stats["hits"], stats["misses"]), (4, 1, 3))
+        self.assertEqual((stats["contexts"], stats["evictions"]), (1, 1))
+
+
+class WatchTest(SyntheticDatasetTestCase):
+    def test_classify_changes(self):
+        import watch
+
+        root = Path(self.tmp_dir.name) / "datasets"
+        paths = [
+            root / "alpha" / "alpha.py",
+            root / "alpha" / "dummy" / "1.0.0" / "dummy_data.zip",
+            root / "beta" / "README.md",
+            root / "beta" / "beta.py.lock",
+            root / "beta" / ".README.md.k2j3h4.tmp",
+            root / "stray.txt",
+            watch.GENERATOR_DIR / "README.template.md",
+            watch.GENERATOR_DIR / "main.py",
+            watch.GENERATOR_DIR / "error.log",
+        ]
+        self.assertEqual(watch.classify_changes(root, paths), (["alpha"], True, ["main.py"]))
+
+    def test_regenerate_changed_datasets(self):
+        import threading
+
+        import watch
+
+        root = Path(self.tmp_dir.name)
+        create_synthetic_dataset(root, "single", ["default"], rows=5)
+        create_synthetic_dataset(root, "other", ["default"], rows=5)
+        writer = DatasetREADMEWriter(cache_dir=root / "cache")
+        with patch.object(DatasetREADMEWriter, "datasets_path", lambda writer: (root / "datasets").resolve()):
+            writer.run()
+        readmes = {name: (root / "datasets" / name / "README.md").read_text() for name in ["single", "other"]}
+
+        started = threading.Event()
+        start = watch.PollingWatcher.start
+
+        def notifying_start(watcher):
+            start(watcher)
+            started.set()
+            return watcher
+
+        with patch.object(watch, "Observer", None), patch.object(watch.PollingWatcher, "start", notifying_start):
+            thread = threading.Thread(
+                target=watch.watch,
+                args=(writer, root / "datasets"),
+                kwargs=dict(debounce=0.05, poll_interval=0.05, timeout=1.0),
+            )
+            thread.start()
+            self.assertTrue(started.wait(10))
+
+            infos_path = root / "datasets" / "single" / "dataset_infos.json"
+            infos = json.loads(infos_path.read_text())
+            infos["default"]["description"] = "An updated description."
+            infos_path.write_text(json.dumps(infos))
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+
+        self.assertIn("An updated description.", (root / "datasets" / "single" / "README.md").read_text())
+        self.assertEqual((root / "datasets" / "other" / "README.md").read_text(), readmes["other"])
+
+
+class WriteIfChangedTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "README.md"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_skip_unchanged(self):
+        from utils import write_if_changed
+
+        self.assertTrue(write_if_changed(self.path, "content"))
+        os.utime(self.path, ns=(0, 0))
+        self.assertFalse(write_if_changed(self.path, "content"))
+        self.assertFalse(write_if_changed(self.path, b"content"))
+        self.assertEqual(self.path.stat().st_mtime_ns, 0)
+        # Same size, other content
+        self.assertTrue(write_if_changed(self.path, "CONTENT"))
+        self.assertEqual(self.path.read_text(), "CONTENT")
+        self.assertNotEqual(self.path.stat().st_mtime_ns, 0)
+
+    def test_preserve_mode(self):
+        from utils import write_if_changed
+
+        self.path.write_text("old content")
+        os.chmod(self.path, 0o640)
+        self.assertTrue(write_if_changed(self.path, "new content"))
+        self.assertEqual(self.path.read_text(), "new content")
+        self.assertEqual(self.path.stat().st_mode & 0o777, 0o640)
+
+    def test_cleanup_on_error(self):
+        from utils import write_if_changed
+
+        self.path.write_text("old content")
+        with patch("os.replace", side_effect=OSError("rename failed")):
+            with self.assertRaises(OSError):
+                write_if_changed(self.path, "new content")
+        self.assertEqual(self.path.read_text(), "old content")
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["README.md"])
+
+
+class DiscoveryTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_include_exclude(self):
+        from discovery import discover_datasets
+
+        for name in ["code_x_glue_cc_clone", "code_x_glue_tc_text_to_code", "glue", "super_glue", "squad"]:
+            (self.root / name).mkdir()
+        (self.root / ".hidden").mkdir()
+
+        def names(**kwargs):
+            return [entry.name for entry in discover_datasets(self.root, **kwargs)]
+
+        code_x_glue = ["code_x_glue_cc_clone", "code_x_glue_tc_text_to_code"]
+        self.assertEqual(names(), code_x_glue + ["glue", "squad", "super_glue"])
+        self.assertEqual(names(include=["*glue"]), ["glue", "super_glue"])
+        self.assertEqual(names(include=["code_x_glue_*", "squad"]), code_x_glue + ["squad"])
+        self.assertEqual(names(exclude=["code_x_glue_*"]), ["glue", "squad", "super_glue"])
+        self.assertEqual(names(include=["*glue*"], exclude=["code_*"]), ["glue", "super_glue"])
+        # Regular expressions must match the whole name
+        self.assertEqual(names(include=["re:code_x_glue_(cc|tc)_.*"]), code_x_glue)
+        self.assertEqual(names(include=["re:glue"]), ["glue"])
+        self.assertEqual(names(exclude=["re:.*_glue|glue"]), code_x_glue + ["squad"])
+        self.assertEqual(names(names=["glue", "squad"], exclude=["squad"]), ["glue"])
+
+    def test_skip_reason(self):
+        from discovery import discover_datasets
+
+        (self.root / "complete").mkdir()
+        (self.root / "complete" / "complete.py").write_text("")
+        (self.root / "no_script").mkdir()
+        (self.root / "no_script" / "other.py").write_text("")
+        (self.root / "stray.txt").write_text("")
+
+        entries = discover_datasets(self.root, names=["complete", "missing", "no_script", "stray.txt"])
+        self.assertEqual(
+            {entry.name: entry.skip_reason() for entry in entries},
+            {
+                "complete": None,
+                "missing": "not a dataset directory",
+                "no_script": "no dataset script no_script.py",
+                "stray.txt": "not a dataset directory",
+            },
+        )
+
+    def test_input_hash_ignores_readme_and_lock_files(self):
+        from cache import dataset_input_hash
+        from discovery import scan_dataset
+        from preview import files_signature
+
+        path = self.root / "single"
+        (path / "dummy" / "1.0.0").mkdir(parents=True)
+        (path / "single.py").write_text("script")
+        (path / "dummy" / "1.0.0" / "dummy_data.zip").write_bytes(b"zip")
+
+        def signatures():
+            entry = scan_dataset(path)
+            return entry.input_hash(), dataset_input_hash(path), files_signature(entry)
+
+        reference = signatures()
+        self.assertEqual(reference[0], reference[1])
+        # The datasets library creates (and touches) a lock file next to the script each time it loads it
+        (path / "single.py.lock").write_text("")
+        (path / "README.md").write_text("card")
+        self.assertEqual(signatures(), reference)
+        os.utime(path / "single.py.lock", ns=(0, 0))
+        self.assertEqual(signatures(), reference)
+
+        (path / "single.py").write_text("new script")
+        changed = signatures()
+        self.assertNotEqual(changed[0], reference[0])
+        self.assertNotEqual(changed[2], reference[2])
+
+
+class ChangedDatasetsTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name) / "datasets"
+        for name in ["alpha", "beta", "gamma", "delta"]:
+            (self.root / name / "dummy").mkdir(parents=True)
+            (self.root / name / f"{name}.py").write_text(name)
+            (self.root / name / "README.md").write_text(name)
+            (self.root / name / "dummy" / "dummy_data.zip").write_text(name)
+        (self.root / "setup.py").write_text("")
+        self.git("init", "-q")
+        self.git("add", ".")
+        self.git("commit", "-q", "-m", "datasets")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def git(self, *args):
+        import subprocess
+
+        command = ["git", "-C", str(self.root), "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        subprocess.run(command + list(args), check=True)
+
+    def test_changed_paths_to_datasets(self):
+        from discovery import changed_datasets
+
+        (self.root / "alpha" / "alpha.py").write_text("new alpha")
+        (self.root / "beta" / "dummy" / "dummy_data.zip").write_text("new beta")
+        # A README change alone needs no new card, a deleted dataset cannot get one, root files are no dataset
+        (self.root / "gamma" / "README.md").write_text("new gamma")
+        self.git("rm", "-q", "-r", "delta")
+        (self.root / "setup.py").write_text("new setup")
+        self.assertEqual(changed_datasets(self.root, "HEAD"), ["alpha", "beta"])
+
+        self.git("commit", "-q", "-a", "-m", "changes")
+        self.assertEqual(changed_datasets(self.root, "HEAD"), [])
+        self.assertEqual(changed_datasets(self.root, "HEAD~1"), ["alpha", "beta"])
+
+    def test_changes_since_the_fork_point(self):
+        from discovery import changed_datasets
+
+        # Upstream moves on after the fork: its changes are not those of the branch
+        self.git("branch", "upstream")
+        self.git("checkout", "-q", "upstream")
+        (self.root / "gamma" / "gamma.py").write_text("upstream gamma")
+        self.git("commit", "-q", "-a", "-m", "upstream")
+        self.git("checkout", "-q", "-")
+        (self.root / "alpha" / "alpha.py").write_text("new alpha")
+        self.git("commit", "-q", "-a", "-m", "branch")
+        (self.root / "beta" / "beta.py").write_text("uncommitted beta")
+        self.assertEqual(changed_datasets(self.root, "upstream"), ["alpha", "beta"])
+
+    def test_named_datasets_intersected(self):
+        import main
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.addCleanup(os.chdir, cwd)
+        processed = []
+
+        def run_entries(writer, dest_path, entries, force, explicit):
+            processed.append([entry.name for entry in entries])
+
+        writer = main.DatasetREADMEWriter(cache_dir=Path(self.tmp_dir.name) / "cache")
+        with patch.object(main.DatasetREADMEWriter, "datasets_path", lambda writer: self.root), patch.object(
+            main.DatasetREADMEWriter, "run_entries", run_entries
+        ), patch.object(main, "changed_datasets", lambda *args: ["alpha", "beta"]):
+            writer.run(to_run=["beta", "gamma"], changed_since="HEAD")
+            writer.run(changed_since="HEAD")
+        self.assertEqual(processed, [["beta"], ["alpha", "beta"]])
+
+    def test_generator_changes(self):
+        import discovery
+
+        generator_dir = Path(discovery.__file__).parent
+        generator_changes = []
+        git_changed_paths = discovery.git_changed_paths
+
+        def fake_git_changed_paths(directory, rev):
+            if Path(directory) == generator_dir:
+                self.assertEqual(rev, "GENERATOR_REV")
+                return generator_changes
+            return git_changed_paths(directory, rev)
+
+        (self.root / "alpha" / "alpha.py").write_text("new alpha")
+        with patch.object(discovery, "git_changed_paths", fake_git_changed_paths):
+            generator_changes[:] = ["README.md", "back/generate_dataset_card.py"]
+            self.assertEqual(discovery.changed_datasets(self.root, "HEAD", "GENERATOR_REV"), ["alpha"])
+            for path in ["main.py", "README.template.md"]:
+                generator_changes[:] = [path]
+                self.assertIsNone(discovery.changed_datasets(self.root, "HEAD", "GENERATOR_REV"))
+            # The revision of the datasets repository is never used for the generator repository
+            self.assertEqual(discovery.changed_datasets(self.root, "HEAD"), ["alpha"])
+
+    def test_git_errors(self):
+        from discovery import GitError, changed_datasets
+
+        with self.assertRaises(GitError) as context:
+            changed_datasets(self.root, "no-such-revision")
+        self.assertIn("no-such-revision", str(context.exception))
+        # What git printed on stderr
+        self.assertIn("fatal:", str(context.exception))
+
+
+class CommandLineTest(TestCase):
+    def test_profile_names_must_be_processed(self):
+        import contextlib
+        import io
+
+        import main
+
+        stderr = io.StringIO()
+        argv = ["main.py", "alpha", "beta", "--profile", "beta,gamma"]
+        with patch("sys.argv", argv), contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit) as context:
+            main.main()
+        self.assertEqual(context.exception.code, 2)
+        self.assertIn("--profile: gamma not in the datasets to process", stderr.getvalue())
+
+
+class ProgressReporterTest(TestCase):
+    def test_counts(self):
+        from progress import ProgressReporter
+
+        progress = ProgressReporter(["a", "b", "c", "d", "e"], stream=io.StringIO())
+        progress.finish("a", "done", 10.0)
+        progress.finish("b", "done", None, cached=True)
+        progress.finish("c", "failed", 5.0)
+        progress.finish("d", "skipped")
+        self.assertEqual(progress.counts, dict(done=2, skipped=1, failed=1, cached=1))
+        self.assertEqual(progress.remaining, {"e"})
+        self.assertTrue(progress.status_line().startswith("[4/5] done 2 (1 cached), skipped 1, failed 1 | "))
+
+    def test_eta(self):
+        from progress import ProgressReporter
+
+        # Expected durations of the previous runs, their mean for the datasets without one, shared by the workers
+        progress = ProgressReporter(["a", "b", "c"], expected_durations=dict(a=10.0, b=20.0), workers=2)
+        self.assertEqual(progress.eta(), (10.0 + 20.0 + 15.0) / 2)
+        # Once some are done, the observed mean replaces it
+        progress.finish("a", "done", 4.0)
+        self.assertEqual(progress.eta(), (20.0 + 4.0) / 2)
+
+        # Without history, no ETA until a dataset is done
+        progress = ProgressReporter(["a", "b", "c"], stream=io.StringIO())
+        self.assertIsNone(progress.eta())
+        self.assertTrue(progress.status_line().endswith("ETA ?"))
+        progress.finish("a", "done", 6.0)
+        self.assertEqual(progress.eta(), 12.0)
+        self.assertTrue(progress.status_line().endswith("ETA 0m12s"))
+        progress.finish("b", "skipped")
+        progress.finish("c", "done", 1.0)
+        self.assertEqual(progress.eta(), 0.0)
+
+    def test_periodic_lines_when_not_a_tty(self):
+        from progress import ProgressReporter
+
+        stream = io.StringIO()
+        with ProgressReporter(["a", "b"], stream=stream, interval=0.05) as progress:
+            progress.log("PROCESSING", "a")
+            time.sleep(0.3)
+            progress.finish("a", "done", 0.1)
+        lines = stream.getvalue().split("\n")
+        self.assertEqual(lines[0], "PROCESSING a")
+        self.assertEqual(lines[-1], "")
+        status_lines = lines[1:-1]
+        # Printed every interval, then once more on close, as plain lines
+        self.assertGreaterEqual(len(status_lines), 3)
+        self.assertNotIn("\r", stream.getvalue())
+        self.assertNotIn("\033", stream.getvalue())
+        self.assertTrue(all(line.startswith("[") for line in status_lines))
+        self.assertTrue(status_lines[-1].startswith("[1/2] done 1 (0 cached)"))
+
+
+class RunMetricsTest(TestCase):
+    def test_openmetrics_output(self):
+        from metrics import RunMetrics
+
+        metrics = RunMetrics()
+        metrics.observe_dataset("done", 0.3)
+        metrics.observe_dataset("done", 7.0)
+        metrics.observe_dataset("failed", 2000.0)
+        metrics.observe_dataset("skipped")
+        metrics.observe_stages(dict(infos=0.05, dummy_data=0.7))
+        metrics.cache_access("context", True)
+        metrics.cache_access("context", False)
+        metrics.cache_access("context", True)
+        metrics.cache_access("context", True)
+        metrics.observe_worker_rss(300 << 20)
+        metrics.observe_worker_rss(200 << 20)
+        lines = metrics.render().split("\n")
+
+        self.assertEqual(lines[-2:], ["# EOF", ""])
+        samples = {}
+        for line in lines[:-2]:
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split(" ")
+                self.assertTrue(name.startswith("readme_generator_"))
+                self.assertIn(kind, ["counter", "gauge", "histogram"])
+            elif not line.startswith("# HELP "):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+
+        self.assertEqual(samples['readme_generator_datasets_total{status="done"}'], 2)
+        self.assertEqual(samples['readme_generator_datasets_total{status="failed"}'], 1)
+        self.assertEqual(samples['readme_generator_datasets_total{status="skipped"}'], 1)
+        # The buckets are cumulative, up to +Inf which counts every observation
+        name = "readme_generator_dataset_duration_seconds"
+        buckets = {bound: samples[f'{name}_bucket{{le="{bound}"}}'] for bound in ["0.1", "0.5", "5.0", "10.0", "+Inf"]}
+        self.assertEqual(buckets, {"0.1": 0, "0.5": 1, "5.0": 1, "10.0": 2, "+Inf": 3})
+        self.assertEqual(samples[f"{name}_count"], 3)
+        self.assertEqual(samples[f"{name}_sum"], 2007.3)
+        name = "readme_generator_stage_duration_seconds"
+        self.assertEqual(samples[f'{name}_bucket{{stage="infos",le="0.1"}}'], 1)
+        self.assertEqual(samples[f'{name}_bucket{{stage="dummy_data",le="0.5"}}'], 0)
+        self.assertEqual(samples[f'{name}_count{{stage="dummy_data"}}'], 1)
+        self.assertEqual(samples['readme_generator_cache_requests_total{cache="context",result="hit"}'], 3)
+        self.assertEqual(samples['readme_generator_cache_requests_total{cache="context",result="miss"}'], 1)
+        self.assertEqual(samples['readme_generator_cache_hit_ratio{cache="context"}'], 0.75)
+        self.assertIn('readme_generator_peak_rss_bytes{process="main"}', samples)
+        self.assertGreaterEqual(samples['readme_generator_peak_rss_bytes{process="workers"}'], 300 << 20)
+
+    def test_peak_rss_units(self):
+        from types import SimpleNamespace
+
+        import utils
+
+        with patch.object(utils.resource, "getrusage", return_value=SimpleNamespace(ru_maxrss=1000)):
+            for platform, expected in [("linux", 1000 * 1024), ("darwin", 1000)]:
+                with patch.object(utils.sys, "platform", platform):
+                    self.assertEqual(utils.peak_rss(), expected)
+
+    def test_written_every_interval(self):
+        from metrics import RunMetrics
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "metrics.prom"
+            metrics = RunMetrics(path, interval=0.05).start()
+            try:
+                # No dataset is done meanwhile: the timer alone rewrites the file
+                for _ in range(100):
+                    if path.exists():
+                        break
+                    time.sleep(0.05)
+                self.assertIn('readme_generator_datasets_total{status="done"} 0', path.read_text())
+                metrics.observe_dataset("done", 1.0)
+            finally:
+                metrics.close()
+            self.assertIn('readme_generator_datasets_total{status="done"} 1', path.read_text())
+            self.assertIsNone(metrics.thread)
+
+
+class MemoryProfileTest(TestCase):
+    def test_stages(self):
+        from memprofile import DatasetMemoryProfile
+
+        size = 8 << 20
+        profile = DatasetMemoryProfile(sample_interval=0.01).start()
+        profile.enter("outer")
+        kept = bytearray(size // 4)
+        profile.enter("inner")
+        temporary = bytearray(size)
+        del temporary
+        profile.exit("inner")
+        profile.exit("outer")
+        result = profile.stop()
+
+        stages = result["stages"]
+        self.assertEqual(sorted(stages), ["inner", "outer"])
+        # The peak of the inner stage counts for the outer stage and the total too
+        for stage in [stages["inner"], stages["outer"], result["total"]]:
+            self.assertGreaterEqual(stage["traced_peak"], size)
+        self.assertLess(stages["inner"]["traced_retained"], size // 8)
+        self.assertGreaterEqual(stages["outer"]["traced_retained"], size // 4)
+        self.assertEqual(stages["inner"]["calls"], 1)
+        # The sites that grew the most: where `kept` was allocated
+        self.assertTrue(any(site["site"].startswith(__file__) for site in stages["outer"]["top_sites"]))
+        self.assertIsNotNone(result["rss_start"])
+        # Sent back from the worker processes
+        json.dumps(result)
+        del kept
+
+    def test_rss_fallback(self):
+        import memprofile
+        import utils
+
+        self.assertGreater(memprofile.current_rss(), 0)
+        with patch("builtins.open", side_effect=OSError):
+            self.assertEqual(memprofile.current_rss(), utils.peak_rss())
+            with patch.object(utils, "resource", None):
+                self.assertIsNone(memprofile.current_rss())
+
+    def test_report(self):
+        from memprofile import format_bytes, memory_report
+
+        def profile(rss_peak, traced_peak):
+            stage = dict(
+                traced_peak=traced_peak, traced_retained=0, rss_peak=rss_peak, rss_retained=0, calls=1, top_sites=[]
+            )
+            return dict(rss_start=100 << 20, total=stage, stages=dict(dummy_data=stage))
+
+        profiles = dict(small=profile(1 << 20, 1 << 10), large=profile(3 << 30, 2 << 20), medium=profile(0, 5 << 20))
+        lines = memory_report(profiles, worst=1).split("\n")
+        self.assertEqual([line.split()[0] for line in lines[1:4]], ["large", "medium", "small"])
+        self.assertEqual(lines[1].split()[1:3], ["3.0GiB", "0B"])
+        self.assertEqual(lines[5], "== large")
+        self.assertNotIn("== medium", lines)
+        self.assertEqual([format_bytes(size) for size in [None, 512, -2048, 5 << 20]], ["?", "512B", "-2.0KiB", "5.0MiB"])
+
+
+def collapsed_total(collapsed):
+    """Total seconds of collapsed stacks."""
+    return sum(int(line.rsplit(" ", 1)[1]) for line in collapsed.splitlines()) / 1e6
+
+
+def countdown(n):
+    sum(range(20000))
+    if n > 0:
+        countdown(n - 1)
+
+
+class DatasetProfilerTest(SyntheticDatasetTestCase):
+    def test_profiled_run(self):
+        import pstats
+
+        root = Path(self.tmp_dir.name)
+        path = create_synthetic_dataset(root, "single", ["default"], rows=5)
+        profile_dir = root / "profiles"
+        (card,) = generate_cards([path], cache_dir=root / "cache", profile=["single"], profile_dir=profile_dir)
+        self.assertIsNone(card.error)
+        self.assertEqual(sorted(os.listdir(profile_dir)), ["single.collapsed", "single.pstats"])
+
+        total_tt = pstats.Stats(str(profile_dir / "single.pstats")).total_tt
+        collapsed = (profile_dir / "single.collapsed").read_text()
+        self.assertIn("gather_context (main.py:", collapsed)
+        self.assertAlmostEqual(collapsed_total(collapsed), total_tt, delta=0.05 * total_tt)
+
+    def test_recursive_root(self):
+        import pstats
+
+        from profiling import DatasetProfiler
+
+        with DatasetProfiler(self.tmp_dir.name, "recursive") as profiler:
+            # Called from outside the profile: its only recorded caller is itself
+            countdown(20)
+        stats = pstats.Stats(profiler.profile)
+        collapsed = (Path(self.tmp_dir.name) / "recursive.collapsed").read_text()
+        self.assertIn("\ncountdown (test_main.py:", "\n" + collapsed)
+        self.assertAlmostEqual(collapsed_total(collapsed), stats.total_tt, delta=0.05 * stats.total_tt)
+
+
+class PipelineTest(TestCase):
+    def test_prefetcher(self):
+        from pipeline import Prefetcher
+
+        for depth in [0, 1, 4]:
+            with self.subTest(depth=depth):
+                self.assertEqual(list(Prefetcher(range(10), lambda i: i * i, depth=depth)), [(i, i * i) for i in range(10)])
+
+                def failing(i):
+                    if i == 3:
+                        raise ValueError(i)
+                    return i
+
+                seen = []
+                with self.assertRaises(ValueError):
+                    for item, _ in Prefetcher(range(10), failing, depth=depth):
+                        seen.append(item)
+                self.assertEqual(seen, [0, 1, 2])
+
+    def test_async_writer(self):
+        from pipeline import AsyncWriter
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for depth in [0, 1, 8]:
+                with self.subTest(depth=depth):
+                    written = []
+                    with AsyncWriter(lambda path, changed, duration: written.append(changed), depth=depth) as output:
+                        for i in range(5):
+                            output.write(Path(tmp_dir) / f"{i % 3}_{depth}.md", "content")
+                    self.assertEqual(written, [True, True, True, False, False])
+
+                    with self.assertRaises(FileNotFoundError):
+                        with AsyncWriter(depth=depth) as output:
+                            output.write(Path(tmp_dir) / "missing" / "README.md", "content")
+
+
+class ValidateTest(SyntheticDatasetTestCase):
+    def test_validate_cards(self):
+        from validate import validate_card, validate_files
+
+        root = Path(self.tmp_dir.name)
+        create_synthetic_dataset(root, "multi", ["alpha", "beta"])
+        (card,) = generate_cards([root / "datasets" / "multi"], cache_dir=root / "cache")
+        self.assertEqual(validate_card(card.markdown), [])
+
+        lines = card.markdown.split("\n")
+
+        def line_number(text):
+            return lines.index(text) + 1
+
+        def corrupted(old, new, count=1):
+            self.assertIn(old, card.markdown)
+            return validate_card(card.markdown.replace(old, new, count))
+
+        self.assertEqual(
+            corrupted("  - [Languages](#languages)", "  - [Languages](#language)"),
+            [(line_number("  - [Languages](#languages)"), "'Languages' links to #language instead of #languages")],
+        )
+        # An anchor built with `lower|replace(" ", "-")` is not the one GitHub gives to the heading
+        self.assertEqual(
+            [
+                message
+                for _, message in corrupted("Source Data](#source-data)", "Source & Data](#source-&-data)", count=-1)
+            ],
+            [
+                "'Source & Data' links to #source-&-data instead of #source--data",
+                "heading 'Source & Data' links to #source-&-data instead of #source--data",
+            ],
+        )
+        self.assertEqual(
+            corrupted("### [Annotations](#annotations)\n", ""),
+            [
+                (
+                    line_number("  - [Annotations](#annotations)"),
+                    "no section 'Annotations' for this table of contents entry",
+                )
+            ],
+        )
+        separator = next(line for line in lines if line.startswith("|---"))
+        self.assertEqual(
+            corrupted(separator + "\n|alpha", separator + "\n|alpha|0"),
+            [(line_number(separator) + 1, "table row with 5 cells instead of 4")],
+        )
+        self.assertEqual(
+            corrupted("- **Homepage:** [https://example.com](https://example.com)", "- **Homepage:** None"),
+            [(line_number("- **Homepage:** [https://example.com](https://example.com)"), "None in the card")],
+        )
+        # None is fine in the examples
+        self.assertEqual(corrupted('"id": "10"', '"id": None'), [])
+
+        (root / "datasets" / "multi" / "README.md").write_text(card.markdown)
+        (root / "datasets" / "broken").mkdir()
+        (root / "datasets" / "broken" / "README.md").write_text("## A\n```\nunclosed\n")
+        results = dict(validate_files([root / "datasets"], workers=2))
+        self.assertEqual(
+            results,
+            {
+                str(root / "datasets" / "broken" / "README.md"): [(2, "code block not closed")],
+                str(root / "datasets" / "multi" / "README.md"): [],
+            },
+        )
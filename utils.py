@@ -1,4 +1,15 @@
+import hashlib
 import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
 indent = 4
 
@@ -220,3 +231,61 @@ def pretty_json(p):
         return "This example was too long and was cropped:\n\n" + p_json
     else:
         return p_json
+
+
+def stable_choice(choices, key, seed=""):
+    """Choose an element of `choices` as a stable function of the `key` string, keyed by `seed`.
+    Unlike `random.choice` or `hash()`, the result is the same across runs and processes."""
+    digest = hashlib.blake2b(key.encode("utf-8"), key=seed.encode("utf-8")[:64], digest_size=8).digest()
+    return choices[int.from_bytes(digest, "big") % len(choices)]
+
+
+# Read the process umask once: os.umask can only be queried by setting it, which is not thread safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_if_changed(path, content):
+    """Atomically write `content` (str or bytes) to `path`, leaving the file untouched if it already holds the same
+    content. Returns True if the file was written, False if it was unchanged."""
+    path = Path(path)
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        stat = None
+    if stat is not None and stat.st_size == len(data):
+        with path.open("rb") as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                return False
+
+    # Write to a temporary file in the same directory, then rename it over the destination, so a crash never
+    # leaves a truncated file behind
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix="." + path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if stat is not None:
+            mode = stat.st_mode & 0o777
+        else:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, str(path))
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+def peak_rss(children=False):
+    """Peak resident set size in bytes of this process (or of the largest of its child processes that exited and were
+    waited for if `children` is set), None when it cannot be read."""
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    # In bytes on macOS, in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
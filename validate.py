@@ -0,0 +1,190 @@
+"""Check that the README.md dataset cards are well formed, and report the violations as PATH:LINE: MESSAGE.
+
+    python validate.py [PATH ...]
+
+PATHs are READMEs or directories (whose */README.md are checked), the datasets tree by default. The exit status is 1
+if there is any violation, so that it can run in a pre-commit hook.
+"""
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+TOC_HEADING = "## Table of Contents"
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+LINKED_TEXT_RE = re.compile(r"^\[(.*)\]\(#([^)]*)\)$")
+TOC_ENTRY_RE = re.compile(r"^(\s*)[-*] \[(.+?)\]\(#([^)]*)\)\s*$")
+TABLE_SEPARATOR_CELL_RE = re.compile(r"^:?-+:?$")
+# A Python None rendered where a value was expected
+NONE_RE = re.compile(r"^\s*None\s*$|:\*\*\s*None\s*$|\[None\]|\(None\)|`None`")
+
+
+def github_slug(text):
+    """The anchor GitHub gives to a heading: lower case, punctuation removed, spaces replaced by hyphens."""
+    return re.sub(r"[^\w\- ]", "", text.lower()).replace(" ", "-")
+
+
+def table_cells(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip() for cell in re.split(r"(?<!\\)\|", line)]
+
+
+class CardValidator:
+    """Check a card in a single pass over its lines (feed them to `line`, then call `finish`):
+    - the TOC entries link to the anchor GitHub gives to their section (the template builds them with
+      `lower|replace(" ", "-")`), and every TOC section exists
+    - the headings that link to themselves use their own anchor
+    - the tables have a separator line and the same number of cells on every line
+    - the code blocks are closed
+    - no None leaked into the card"""
+
+    def __init__(self):
+        self.violations = []
+        self.in_code = False
+        self.code_start = None
+        self.in_toc = False
+        # (line number, text, anchor) of the table of contents entries
+        self.toc = []
+        # Heading text -> anchor of its first heading (duplicate slugs get -1, -2... like on GitHub)
+        self.sections = {}
+        self.slug_counts = {}
+        # [line number of the header, number of cells, number of lines so far]
+        self.table = None
+
+    def violation(self, line_number, message):
+        self.violations.append((line_number, message))
+
+    def end_table(self):
+        if self.table is not None and self.table[2] < 2:
+            self.violation(self.table[0], "table without a separator line")
+        self.table = None
+
+    def table_line(self, line_number, line):
+        cells = table_cells(line)
+        if self.table is None:
+            self.table = [line_number, len(cells), 1]
+            return
+        if self.table[2] == 1 and not all(TABLE_SEPARATOR_CELL_RE.match(cell) for cell in cells):
+            self.violation(line_number, "table without a separator line")
+        elif len(cells) != self.table[1]:
+            self.violation(line_number, f"table row with {len(cells)} cells instead of {self.table[1]}")
+        self.table[2] += 1
+
+    def heading(self, line_number, text):
+        linked = LINKED_TEXT_RE.match(text)
+        if linked is not None:
+            text, link = linked.groups()
+        slug = github_slug(text)
+        count = self.slug_counts.get(slug, 0)
+        self.slug_counts[slug] = count + 1
+        anchor = slug if count == 0 else f"{slug}-{count}"
+        self.sections.setdefault(text, anchor)
+        if linked is not None and link != anchor:
+            self.violation(line_number, f"heading '{text}' links to #{link} instead of #{anchor}")
+
+    def line(self, line_number, line):
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            self.end_table()
+            self.in_code = not self.in_code
+            self.code_start = line_number
+            return
+        if self.in_code:
+            return
+
+        if NONE_RE.search(line):
+            self.violation(line_number, "None in the card")
+
+        if stripped.startswith("|"):
+            self.table_line(line_number, line)
+            return
+        self.end_table()
+
+        match = HEADING_RE.match(line)
+        if match is not None:
+            self.in_toc = line.rstrip() == TOC_HEADING
+            self.heading(line_number, match.group(2))
+            return
+        if self.in_toc:
+            entry = TOC_ENTRY_RE.match(line)
+            if entry is not None:
+                self.toc.append((line_number, entry.group(2), entry.group(3)))
+            elif stripped:
+                self.violation(line_number, "unexpected line in the table of contents")
+
+    def finish(self):
+        self.end_table()
+        if self.in_code:
+            self.violation(self.code_start, "code block not closed")
+        for line_number, text, anchor in self.toc:
+            if text not in self.sections:
+                self.violation(line_number, f"no section '{text}' for this table of contents entry")
+            elif anchor != self.sections[text]:
+                self.violation(line_number, f"'{text}' links to #{anchor} instead of #{self.sections[text]}")
+        return sorted(self.violations)
+
+
+def validate_card(text):
+    """The violations of a card, as sorted (line number, message) pairs."""
+    validator = CardValidator()
+    for line_number, line in enumerate(text.split("\n"), 1):
+        validator.line(line_number, line)
+    return validator.finish()
+
+
+def validate_file(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return path, [(0, f"cannot be read: {e}")]
+    return path, validate_card(text)
+
+
+def card_paths(paths):
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            yield from sorted(str(readme) for readme in path.glob("*/README.md"))
+        else:
+            yield str(path)
+
+
+def validate_files(paths, workers=None):
+    """Yield (path, violations) for each README of `paths` (see card_paths), checked by `workers` processes."""
+    paths = list(card_paths(paths))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < 2 * workers:
+        yield from map(validate_file, paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(validate_file, paths, chunksize=max(1, len(paths) // (4 * workers)))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("paths", nargs="*", help="READMEs or directories of datasets (default: the datasets tree)")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    paths = args.paths or [Path(__file__).parent / "datasets"]
+    checked = failed = 0
+    for path, violations in validate_files(paths, workers=args.workers):
+        checked += 1
+        if violations:
+            failed += 1
+        for line_number, message in violations:
+            print(f"{path}:{line_number}: {message}")
+    print(f"{checked} card(s) checked, {failed} with violations", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
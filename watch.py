@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+from discovery import GENERATOR_PATHS, discover_datasets
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # Polling fallback
+    Observer = None
+
+GENERATOR_DIR = Path(__file__).resolve().parent
+
+
+class ChangeCollector:
+    """Changed paths, reported by the watcher threads, handed out in batches once no change came for `debounce`
+    seconds: saving a file often means several writes, and a checkout touches many files."""
+
+    def __init__(self, debounce=0.2):
+        self.debounce = debounce
+        self.paths = set()
+        self.last_change = None
+        self.condition = threading.Condition()
+
+    def add(self, path):
+        with self.condition:
+            self.paths.add(str(path))
+            self.last_change = time.monotonic()
+            self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait for a batch of changes and return it, or an empty set after `timeout` seconds without any."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while len(self.paths) == 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return set()
+                self.condition.wait(remaining)
+            while True:
+                quiet = time.monotonic() - self.last_change
+                if quiet >= self.debounce:
+                    break
+                self.condition.wait(self.debounce - quiet)
+            paths, self.paths = self.paths, set()
+            return paths
+
+
+def stat_tree(root, recursive=True):
+    """{path: (size, mtime)} of the files of `root`."""
+    files = {}
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    except OSError:
+                        # Removed while scanning
+                        pass
+        except OSError:
+            pass
+    return files
+
+
+class PollingWatcher:
+    """Report to a ChangeCollector the files created, modified or deleted under some directories, by scanning them
+    every `interval` seconds: the fallback when watchdog is not installed."""
+
+    def __init__(self, collector, directories, interval=1.0):
+        # [(directory, recursive)]
+        self.directories = directories
+        self.collector = collector
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def scan(self):
+        files = {}
+        for directory, recursive in self.directories:
+            files.update(stat_tree(str(directory), recursive))
+        return files
+
+    def run(self, files):
+        while not self.stopped.wait(self.interval):
+            new_files = self.scan()
+            for path in files.keys() | new_files.keys():
+                if files.get(path) != new_files.get(path):
+                    self.collector.add(path)
+            files = new_files
+
+    def start(self):
+        # The first scan is done before returning, so that no change made after start() is missed
+        self.thread = threading.Thread(target=self.run, args=(self.scan(),), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+if Observer is not None:
+
+    class CollectingHandler(FileSystemEventHandler):
+        def __init__(self, collector):
+            self.collector = collector
+
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            self.collector.add(event.src_path)
+            if getattr(event, "dest_path", None):
+                self.collector.add(event.dest_path)
+
+    class NotifyWatcher:
+        """Report to a ChangeCollector the files created, modified, moved or deleted under some directories, as
+        notified by the OS through watchdog (inotify on Linux)."""
+
+        def __init__(self, collector, directories):
+            self.observer = Observer()
+            handler = CollectingHandler(collector)
+            for directory, recursive in directories:
+                self.observer.schedule(handler, str(directory), recursive=recursive)
+
+        def start(self):
+            self.observer.start()
+            return self
+
+        def stop(self):
+            self.observer.stop()
+            self.observer.join()
+
+
+def classify_changes(root, paths):
+    """Map changed paths to what has to be done: returns (dataset names whose files changed, whether the template
+    changed, the generator source files that changed).
+    READMEs and the temporary files they are written through (by the generator itself), and the lock files the
+    datasets library creates are left out."""
+    names = set()
+    template_changed = False
+    generator_changes = set()
+    for path in paths:
+        path = Path(path)
+        if path.parent == GENERATOR_DIR and path.name in GENERATOR_PATHS:
+            if path.name == "README.template.md":
+                template_changed = True
+            else:
+                generator_changes.add(path.name)
+            continue
+        try:
+            parts = path.relative_to(root).parts
+        except ValueError:
+            continue
+        if len(parts) < 2 or parts[1:] == ("README.md",) or path.name.endswith(".lock") or "__pycache__" in parts:
+            continue
+        # The temporary files of write_if_changed (.README.md.XXXX.tmp)
+        if path.name.startswith(".") and path.name.endswith(".tmp"):
+            continue
+        names.add(parts[0])
+    return sorted(names), template_changed, sorted(generator_changes)
+
+
+def watch(writer, dest_path, to_run=None, include=None, exclude=None, debounce=0.2, poll_interval=1.0, timeout=None):
+    """Regenerate the cards of the datasets of `dest_path` whose files change, with the warm runtime and caches of
+    `writer` (a DatasetREADMEWriter), until interrupted (or until no change came for `timeout` seconds).
+    Only the datasets of `to_run` (if given) matching the include/exclude patterns are regenerated. A template
+    change renders the cached contexts again."""
+    from main import load_template
+
+    dest_path = Path(dest_path).resolve()
+    collector = ChangeCollector(debounce)
+    directories = [(dest_path, True), (GENERATOR_DIR, False)]
+    if Observer is not None:
+        watcher = NotifyWatcher(collector, directories).start()
+    else:
+        watcher = PollingWatcher(collector, directories, poll_interval).start()
+    print(f"Watching {dest_path} for changes ({type(watcher).__name__}), Ctrl-C to stop")
+
+    try:
+        while True:
+            paths = collector.wait(timeout)
+            if len(paths) == 0:
+                return
+            start = time.time()
+            names, template_changed, generator_changes = classify_changes(dest_path, paths)
+            if generator_changes:
+                print("Generator changed (" + ", ".join(generator_changes) + "): restart to use the new code")
+
+            if to_run is not None:
+                names = [name for name in names if name in to_run]
+            entries = discover_datasets(dest_path, names=names, include=include, exclude=exclude)
+            # Deleted datasets cannot get a card
+            entries = [entry for entry in entries if entry.is_dir]
+            for entry in entries:
+                writer.errors.pop(entry.name, None)
+                writer.warnings.pop(entry.name, None)
+            if entries:
+                writer.run_entries(dest_path, entries, force=True, explicit=True)
+
+            rerender = []
+            if template_changed:
+                writer.template = load_template()
+                # The datasets just regenerated already used the new template
+                done = {entry.name for entry in entries}
+                rerender = [name for name in writer.rerender_names(dest_path, to_run) if name not in done]
+                writer.rerender_cards(dest_path, rerender)
+
+            if entries or template_changed:
+                writer.dump_info(writer.errors, "error")
+                writer.dump_info(writer.warnings, "warning")
+                print(f"Regenerated {len(entries) + len(rerender)} card(s) in {time.time() - start:.2f}s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        writer.close()